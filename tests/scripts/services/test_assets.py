@@ -2,11 +2,29 @@
 
 
 import pytest
+import resource
 import shutil
+import tempfile
+import json
 import os
+import bz2
+import gzip
+import lzma
+import struct
+import zlib
 from os import path
 from rdflib.term import URIRef
-from umakaparser.scripts.services.assets import separate_large_owl, output_process, join_process, index_owl
+from rdflib.graph import Graph
+from umakaparser.scripts.services.assets import (
+    separate_large_owl, iter_owl_chunks, iter_subject_shards, read_chunk, output_process, turtle_rows, ntriples_rows,
+    join_process, index_owl, chunk_ranges, pack_small_files, PrefixDeclarations
+)
+from umakaparser.scripts.services import assets as assets_module
+from umakaparser.scripts.services.manifest import ManifestMismatchError
+from umakaparser.scripts.services.scheduler import MemoryScheduler
+from umakaparser.scripts.services.compression import is_bgzf, read_bgzf_lines
+from umakaparser.scripts.services.build import AssetReader
+from umakaparser.scripts.services.curie import CurieCompactor
 
 
 @pytest.fixture
@@ -17,27 +35,87 @@ def testdata_paths(fixture_dir):
     return testdatas
 
 
-def test_saparate_large_owl(testdata_paths):
+@pytest.fixture
+def turtle_paths(testdata_paths, tmp_path):
+    turtle_paths = []
+    for testdata_path in testdata_paths:
+        turtle_path = tmp_path / path.basename(testdata_path).replace('.nt', '.ttl')
+        shutil.copy(testdata_path, str(turtle_path))
+        turtle_paths.append(str(turtle_path))
+    return turtle_paths
+
+
+TARGET_PROPERTIES = {
+    URIRef('http://www.w3.org/2002/07/owl#sameAs'): 'sameAs',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#label'): 'label',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#subClassOf'): 'subClassOf',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#domain'): 'domain',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#range'): 'range',
+}
+
+
+def test_saparate_large_owl(turtle_paths):
     comment_length = 1
     prefix_length = 3
     exclude_length = comment_length + prefix_length
-    total_length = (100 - exclude_length) * 2 + 90 - exclude_length
+    file_lengths = [100 - exclude_length, 100 - exclude_length, 90 - exclude_length]
 
     def check_separated_files(limit_of_lines):
-        prefix, temp_files, temp_dir = separate_large_owl(testdata_paths[:-1], limit_of_lines)
+        prefix, chunks = separate_large_owl(turtle_paths[:-1], limit_of_lines)
         assert '@prefix rdf:' in prefix
         assert '@prefix rdfs:' in prefix
         assert '@prefix owl:' in prefix
-        assert len(temp_files) == int(total_length / limit_of_lines + 1)
-        assert len(list(open(temp_files[-1]))) == total_length % limit_of_lines
-        shutil.rmtree(temp_dir)
+        assert len(chunks) == sum(-(-length // limit_of_lines) for length in file_lengths)
+        for file_path, start, end in chunks:
+            assert file_path in turtle_paths
+            assert 0 <= start < end <= path.getsize(file_path)
+
+        def statements(chunk):
+            return [row for row in read_chunk(chunk).splitlines() if row.endswith(' .') and not row.startswith('@')]
+        assert len(statements(chunks[-1])) == file_lengths[-1] % limit_of_lines
+        assert sum(len(statements(chunk)) for chunk in chunks) == sum(file_lengths)
 
     check_separated_files(100)
     check_separated_files(30)
 
 
+def test_separate_ntriples(testdata_paths):
+    prefix, chunks = separate_large_owl(testdata_paths[:1], 10)
+    assert prefix == ''
+    assert 1 < len(chunks)
+    assert chunks[0][1] == 0
+    assert chunks[-1][2] == path.getsize(testdata_paths[0])
+    for (_, _, end), (_, start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+    for chunk in chunks:
+        assert read_chunk(chunk).endswith('\n')
+
+
+def test_ntriples_rows(testdata_paths, turtle_paths):
+    for testdata_path, turtle_path in zip(testdata_paths, turtle_paths):
+        with open(testdata_path) as fp:
+            data = fp.read()
+        rows, prefixes, _ = ntriples_rows('', data, TARGET_PROPERTIES)
+        assert len(prefixes) == 3
+        assert set(rows) == set(turtle_rows('', data, TARGET_PROPERTIES)[0])
+
+    data = (
+        '<http://example.org/A> <http://www.w3.org/2000/01/rdf-schema#label> "say \\"A\\""@en .\n'
+        'ex:B <http://www.w3.org/2000/01/rdf-schema#subClassOf> ex:A .\n'
+        '<http://example.org/C> <http://www.w3.org/2000/01/rdf-schema#label> '
+        '"3"^^<http://www.w3.org/2001/XMLSchema#string> .\n'
+    )
+    rows, _, _ = ntriples_rows('@prefix ex: <http://example.org/> .\n', data, TARGET_PROPERTIES)
+    assert set(rows) == {
+        ('label', '<http://example.org/A>', '"say \\"A\\""@en'),
+        ('subClassOf', '<http://example.org/B>', '<http://example.org/A>'),
+        ('label', '<http://example.org/C>', '"3"^^<http://www.w3.org/2001/XMLSchema#string>'),
+    }
+
+
 def test_output_process(testdata_paths):
-    prefix, temp_files, temp_dir = separate_large_owl(testdata_paths, 100)
+    prefix, chunks = separate_large_owl(testdata_paths, 100)
+    temp_dir = tempfile.mkdtemp()
 
     target_properties = {
         URIRef('http://www.w3.org/2002/07/owl#sameAs'): 'sameAs',
@@ -49,8 +127,8 @@ def test_output_process(testdata_paths):
     out_dirs = [path.join(temp_dir, t) for t in target_properties.values()]
     for out_dir in out_dirs:
         os.mkdir(out_dir)
-    for temp_file in temp_files:
-        output_process((prefix, temp_file, target_properties, temp_dir))
+    for chunk in chunks:
+        output_process((prefix, chunk, target_properties, temp_dir, None))
 
     for out_dir in out_dirs:
         child_files = os.listdir(out_dir)
@@ -60,8 +138,33 @@ def test_output_process(testdata_paths):
     shutil.rmtree(temp_dir)
 
 
+def test_output_process_excludes_restrictions(tmp_path):
+    ttl = tmp_path / 'restriction.ttl'
+    ttl.write_text(
+        '@prefix ex: <http://example.org/> .\n'
+        '@prefix owl: <http://www.w3.org/2002/07/owl#> .\n'
+        '@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n'
+        'ex:A rdfs:subClassOf ex:B .\n'
+        'ex:A rdfs:subClassOf ex:R .\n'
+        'ex:R owl:onProperty ex:p .\n'
+        'ex:A rdfs:comment "ignored" .\n'
+    )
+    prefix, chunks = separate_large_owl([str(ttl)], 100)
+    target_properties = {URIRef('http://www.w3.org/2000/01/rdf-schema#subClassOf'): 'subClassOf'}
+    os.mkdir(str(tmp_path / 'subClassOf'))
+    for chunk in chunks:
+        output_process((prefix, chunk, target_properties, str(tmp_path), None))
+
+    rows = []
+    for name in os.listdir(str(tmp_path / 'subClassOf')):
+        with open(str(tmp_path / 'subClassOf' / name)) as fp:
+            rows.extend(json.loads(row) for row in fp)
+    assert rows == [{'s': '<http://example.org/A>', 'o': '<http://example.org/B>'}]
+
+
 def test_join_process(testdata_paths):
-    prefix, temp_files, temp_dir = separate_large_owl(testdata_paths, 100)
+    prefix, chunks = separate_large_owl(testdata_paths, 100)
+    temp_dir = tempfile.mkdtemp()
 
     target_properties = {
         URIRef('http://www.w3.org/2002/07/owl#sameAs'): 'sameAs',
@@ -73,14 +176,14 @@ def test_join_process(testdata_paths):
     out_dirs = [path.join(temp_dir, t) for t in target_properties.values()]
     for out_dir in out_dirs:
         os.mkdir(out_dir)
-    for temp_file in temp_files:
-        output_process((prefix, temp_file, target_properties, temp_dir))
+    for chunk in chunks:
+        output_process((prefix, chunk, target_properties, temp_dir, None))
     empty_dirs = [od for od in out_dirs if len(os.listdir(od)) == 0]
 
     dist_dir = path.join(temp_dir, 'dist')
     os.mkdir(dist_dir)
     for op in target_properties.values():
-        join_process((dist_dir, temp_dir, op))
+        join_process((dist_dir, temp_dir, op, set()))
 
     for out_dir in out_dirs:
         if out_dir in empty_dirs:
@@ -91,6 +194,42 @@ def test_join_process(testdata_paths):
     shutil.rmtree(temp_dir)
 
 
+def test_join_process_merges_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr('umakaparser.scripts.services.assets.MERGE_FAN_IN', 2)
+    run_dir = tmp_path / 'label'
+    run_dir.mkdir()
+    rows = [json.dumps({'s': '<http://example.org/{}>'.format(i % 7), 'o': '"{}"'.format(i % 7)}) + '\n'
+            for i in range(30)]
+    for idx in range(5):
+        (run_dir / 'tmp{}'.format(idx)).write_text(''.join(sorted(set(rows[idx::5]))))
+    dist_dir = tmp_path / 'dist'
+    dist_dir.mkdir()
+    join_process((str(dist_dir), str(tmp_path), 'label', {'"3"'}))
+
+    with open(str(dist_dir / 'label')) as fp:
+        merged = list(fp)
+    assert merged == sorted(set(rows) - {rows[3]})
+
+
+# assetのディレクトリのファイルの内容を名前をキーにして返す。namesを指定した場合はその名前のファイルだけを読む。
+def read_assets(dist_dir, names=None):
+    assets = {}
+    for name in os.listdir(dist_dir) if names is None else names:
+        with open(path.join(dist_dir, name)) as fp:
+            assets[name] = fp.read()
+    return assets
+
+
+# index_owlで作ったassetを読んで返す。
+def index_assets(owl_file_paths, dist='dist', names=None, **kwargs):
+    return read_assets(index_owl(owl_file_paths, TARGET_PROPERTIES, dist, **kwargs), names)
+
+
+# チャンクの全てのバイト範囲を読んでつなげる。
+def read_ranges(chunk):
+    return ''.join(map(read_chunk, chunk_ranges(chunk)))
+
+
 def test_index_owl(testdata_paths):
     target_properties = {
         URIRef('http://www.w3.org/2002/07/owl#sameAs'): 'sameAs',
@@ -119,6 +258,298 @@ def test_index_owl(testdata_paths):
     with open(path.join(dist_dir, 'range'), 'r') as fp:
         assert len(list(fp)) == 1
     with open(path.join(dist_dir, 'prefix.ttl'), 'r') as fp:
-        assert len(list(fp)) == 12
+        assert len(list(fp)) == 3
 
     shutil.rmtree(dist_dir)
+
+
+def test_iter_subject_shards(tmp_path):
+    ttl = tmp_path / 'shards.ttl'
+    ttl.write_text(
+        '@prefix ex: <http://example.org/> .\n'
+        + ''.join('ex:C{0} ex:p _:b{0} .\n_:b{0} ex:q ex:D{0} .\n'.format(i) for i in range(20))
+    )
+    prefixes = PrefixDeclarations()
+    shards = list(iter_subject_shards([str(ttl)], 4, prefixes, str(tmp_path)))
+    assert prefixes == ['@prefix ex: <http://example.org/> .\n']
+    assert 1 < len(shards) <= 4
+    for i in range(20):
+        holders = [shard for shard in shards if 'ex:C{} '.format(i) in read_ranges(shard)]
+        assert len(holders) == 1
+        assert '_:b{} ex:q'.format(i) in read_ranges(holders[0])
+
+
+def test_iter_subject_shards_sub_chunks(tmp_path):
+    owl_file_paths = []
+    for name in ('a', 'b'):
+        ttl = tmp_path / '{}.ttl'.format(name)
+        ttl.write_text(
+            '@prefix ex: <http://example.org/> .\n'
+            + ''.join('ex:{0}{1} ex:p ex:D{1} .\n'.format(name, i) for i in range(20))
+        )
+        owl_file_paths.append(str(ttl))
+    opened = []
+
+    def paths():
+        for owl_file_path in owl_file_paths:
+            opened.append(owl_file_path)
+            yield owl_file_path
+
+    chunks = iter_subject_shards(paths(), 2, PrefixDeclarations(), str(tmp_path), maximum_lines_per_file=3)
+    # 全てのファイルを読み終える前に、区切ったサブチャンクから返す。
+    first = next(chunks)
+    assert opened == owl_file_paths[:1]
+    texts = [read_ranges(chunk) for chunk in [first] + list(chunks)]
+    assert all(0 < text.count(' .\n') <= 3 for text in texts)
+    assert sorted(row for text in texts for row in text.splitlines()) == sorted(
+        'ex:{0}{1} ex:p ex:D{1} .'.format(name, i) for name in ('a', 'b') for i in range(20))
+
+
+def test_index_owl_shards(testdata_paths, turtle_paths, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    names = TARGET_PROPERTIES.values()
+    expected = index_assets(testdata_paths, names=names)
+    assert index_assets(testdata_paths, names=names, shards=3) == expected
+    assert index_assets(turtle_paths, names=names, shards=5) == expected
+
+
+def test_index_owl_binary(testdata_paths, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    index_owl(testdata_paths, TARGET_PROPERTIES, 'jsonl')
+    index_owl(testdata_paths, TARGET_PROPERTIES, 'binary', asset_format='binary')
+
+    assert not path.exists(str(tmp_path / 'binary' / 'label'))
+    assert path.exists(str(tmp_path / 'binary' / 'terms.bin'))
+    compactor = CurieCompactor(Graph())
+    jsonl_reader = AssetReader(str(tmp_path / 'jsonl'))
+    binary_reader = AssetReader(str(tmp_path / 'binary'))
+    for name in ('sameAs', 'subClassOf', 'domain', 'range'):
+        expected = list(jsonl_reader.read_subject_object(name, compactor))
+        assert expected
+        assert list(binary_reader.read_subject_object(name, compactor)) == expected
+    assert list(binary_reader.read_subject_literal('label', compactor)) == \
+        list(jsonl_reader.read_subject_literal('label', compactor))
+
+
+def test_index_owl_cache(testdata_paths, turtle_paths, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    cache_dir = str(tmp_path / 'cache')
+    owl_file_paths = testdata_paths[:2] + turtle_paths[2:]
+
+    expected = index_assets(owl_file_paths, 'expected')
+    assert index_assets(owl_file_paths, cache_dir=cache_dir) == expected
+    assert len(os.listdir(cache_dir)) == len(owl_file_paths)
+    assert index_assets(owl_file_paths, cache_dir=cache_dir) == expected
+    assert len(os.listdir(cache_dir)) == len(owl_file_paths)
+
+    # 2回目以降はキャッシュの出力がそのまま使われる。
+    cached_row = '{"s": "<http://example.org/cached>", "o": "<http://example.org/C>"}\n'
+    for key in os.listdir(cache_dir):
+        with open(path.join(cache_dir, key, 'entry.json')) as fp:
+            for name in json.load(fp)['outputs'].get('subClassOf', []):
+                with open(path.join(cache_dir, key, name), 'a') as fp:
+                    fp.write(cached_row)
+    assert cached_row in index_assets(owl_file_paths, cache_dir=cache_dir)['subClassOf']
+
+    with open(owl_file_paths[-1], 'a') as fp:
+        fp.write('<http://example.org/A> <http://www.w3.org/2000/01/rdf-schema#label> "A" .\n')
+    assets = index_assets(owl_file_paths, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == len(owl_file_paths) + 1
+    assert '{"s": "<http://example.org/A>", "o": "\\"A\\""}\n' in assets['label']
+
+
+def interrupted_output_process(args):
+    if any(path.basename(r[0]) == 'test.nt' for r in chunk_ranges(args[1])):
+        raise RuntimeError('interrupted')
+    return OUTPUT_PROCESS(args)
+
+
+OUTPUT_PROCESS = assets_module.output_process
+
+
+def test_index_owl_resume(testdata_paths, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    scratch_dir = str(tmp_path / 'scratch')
+    expected = index_assets(testdata_paths, 'expected')
+
+    with monkeypatch.context() as m:
+        m.setattr(assets_module, 'output_process', interrupted_output_process)
+        with pytest.raises(RuntimeError):
+            index_owl(testdata_paths, TARGET_PROPERTIES, 'dist', scratch_dir=scratch_dir, chunk_size=10)
+    manifest_path = path.join(scratch_dir, 'umakaparser-index', 'manifest.jsonl')
+    with open(manifest_path) as fp:
+        events = [json.loads(row)['event'] for row in fp]
+    assert events[0] == 'start'
+    assert 'done' in events
+
+    # 処理済みのチャンクは飛ばして、残りだけを処理する。
+    index_owl(testdata_paths, TARGET_PROPERTIES, 'dist', scratch_dir=scratch_dir, resume=True, chunk_size=10)
+    assets = read_assets(str(tmp_path / 'dist'))
+    assert assets == expected
+    assert not os.path.exists(path.join(scratch_dir, 'umakaparser-index'))
+
+    with monkeypatch.context() as m:
+        m.setattr(assets_module, 'output_process', interrupted_output_process)
+        with pytest.raises(RuntimeError):
+            index_owl(testdata_paths, TARGET_PROPERTIES, 'dist', scratch_dir=scratch_dir, chunk_size=10)
+    with pytest.raises(ManifestMismatchError):
+        index_owl(testdata_paths[1:], TARGET_PROPERTIES, 'dist', scratch_dir=scratch_dir, resume=True, chunk_size=10)
+
+
+def test_memory_scheduler():
+    scheduler = MemoryScheduler(4, max_memory=1000)
+    first, second, third, fourth = [('a.ttl', start, start + 100) for start in range(0, 400, 100)]
+    assert scheduler.chunk_bytes is None
+    assert scheduler.acquire(first, timeout=0)
+    # 見積もりができるまでは1つずつ処理する。
+    assert not scheduler.acquire(second, timeout=0)
+    scheduler.release({'chunk': first, 'memory': 400})
+    assert scheduler.ratio == 4
+    assert scheduler.acquire(second, timeout=0)
+    assert scheduler.acquire(third, timeout=0)
+    assert not scheduler.acquire(fourth, timeout=0)
+    scheduler.release({'chunk': second, 'memory': 400})
+    assert scheduler.acquire(fourth, timeout=0)
+
+    unlimited = MemoryScheduler(1)
+    assert unlimited.acquire(first, timeout=0)
+    assert unlimited.acquire(second, timeout=0)
+    assert not unlimited.acquire(third, timeout=0)
+
+
+def test_separate_with_chunk_bytes(testdata_paths, turtle_paths):
+    class Scheduler(object):
+        chunk_bytes = 2000
+
+    for owl_file_paths in (testdata_paths, turtle_paths):
+        prefixes = []
+        chunks = list(iter_owl_chunks(owl_file_paths, 50000, prefixes, scheduler=Scheduler()))
+        assert len(chunks) > len(owl_file_paths)
+        for file_path in owl_file_paths:
+            file_chunks = [c for c in chunks if c[0] == file_path]
+            assert file_chunks[0][1] == 0
+            assert file_chunks[-1][2] == os.path.getsize(file_path)
+            assert all(a[2] == b[1] for a, b in zip(file_chunks, file_chunks[1:]))
+
+
+def test_index_owl_max_memory(testdata_paths, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    expected = index_assets(testdata_paths, 'expected')
+    assert index_assets(testdata_paths, workers=2, chunk_size=10, max_memory=1 << 30) == expected
+
+
+# BGZF(bgzip)形式で書き出す。
+def write_bgzf(file_path, data, block_size=1000):
+    with open(file_path, 'wb') as fp:
+        for idx in range(0, len(data), block_size):
+            block = data[idx:idx + block_size]
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            deflated = compressor.compress(block) + compressor.flush()
+            fp.write(struct.pack('<4BI2BH2sHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, b'BC', 2, len(deflated) + 25))
+            fp.write(deflated)
+            fp.write(struct.pack('<II', zlib.crc32(block), len(block)))
+
+
+@pytest.fixture
+def compressed_paths(testdata_paths, turtle_paths, tmp_path):
+    openers = [gzip.open, bz2.open, lzma.open]
+    extensions = ['.gz', '.bz2', '.xz']
+    compressed_paths = []
+    for idx, source in enumerate([testdata_paths[0], turtle_paths[1], testdata_paths[2]]):
+        compressed_path = str(tmp_path / (path.basename(source) + extensions[idx]))
+        with open(source, 'rb') as src, openers[idx](compressed_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        compressed_paths.append(compressed_path)
+    bgzf_path = str(tmp_path / (path.basename(testdata_paths[3]) + '.gz'))
+    with open(testdata_paths[3], 'rb') as fp:
+        write_bgzf(bgzf_path, fp.read())
+    compressed_paths.append(bgzf_path)
+    return compressed_paths
+
+
+def test_read_bgzf_lines(testdata_paths, tmp_path):
+    with open(testdata_paths[0], 'rb') as fp:
+        data = fp.read()
+    bgzf_path = str(tmp_path / 'first.nt.gz')
+    write_bgzf(bgzf_path, data, block_size=777)
+    assert is_bgzf(bgzf_path)
+    assert not is_bgzf(testdata_paths[0])
+
+    # どこで区切っても、各行はちょうど1つの範囲に含まれる。
+    size = path.getsize(bgzf_path)
+    offsets = [0]
+    with open(bgzf_path, 'rb') as fp:
+        while offsets[-1] < size:
+            fp.seek(offsets[-1] + 16)
+            offsets.append(offsets[-1] + struct.unpack('<H', fp.read(2))[0] + 1)
+    for step in (1, 2, 5):
+        bounds = offsets[::step] + ([size] if offsets[::step][-1] != size else [])
+        assert b''.join(read_bgzf_lines(bgzf_path, a, b) for a, b in zip(bounds, bounds[1:])) == data
+
+
+def test_index_owl_compressed(testdata_paths, turtle_paths, compressed_paths, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    plain_paths = [testdata_paths[0], turtle_paths[1], testdata_paths[2], testdata_paths[3]]
+
+    expected = index_assets(plain_paths)
+    assert index_assets(compressed_paths) == expected
+    assert index_assets(compressed_paths, chunk_size=10) == expected
+    assert index_assets(compressed_paths, shards=3) == expected
+
+
+def test_pack_small_files(turtle_paths, tmp_path):
+    size = path.getsize(turtle_paths[0])
+    payloads = [((file_path, 0, path.getsize(file_path)), None) for file_path in turtle_paths]
+    payloads.insert(1, ((turtle_paths[1], 0, 10), None))
+    packed = [chunk for chunk, _ in pack_small_files(payloads, size * 2)]
+    assert packed[0] == (turtle_paths[0], 0, size)
+    assert packed[1] == (turtle_paths[1], 0, 10)
+    assert sum(len(chunk_ranges(chunk)) for chunk in packed) == len(payloads)
+    assert any(isinstance(chunk[0], tuple) for chunk in packed)
+
+
+def test_index_owl_many_files(testdata_paths, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    expected = index_assets(testdata_paths, 'expected')
+
+    # 1文ずつのファイルに分け、どのファイルにもprefix宣言を書いておく。
+    small_paths = []
+    for testdata_path in testdata_paths:
+        with open(testdata_path) as fp:
+            rows = list(fp)
+        prefixes = [row for row in rows if row.startswith('@prefix')]
+        for row in rows:
+            if row.startswith('@prefix') or not row.strip():
+                continue
+            small_path = str(tmp_path / 'small-{}.nt'.format(len(small_paths)))
+            with open(small_path, 'w') as fp:
+                fp.writelines(prefixes + [row])
+            small_paths.append(small_path)
+
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    assert len(small_paths) > 256
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard_limit))
+    try:
+        index_owl(small_paths, TARGET_PROPERTIES, 'dist', workers=2)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft_limit, hard_limit))
+    assets = read_assets(str(tmp_path / 'dist'))
+    assert assets == expected
+
+
+def test_index_owl_rebound_prefix(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    # 同じprefixを別の名前空間に宣言し直したファイルの後で、最初の宣言に戻す。
+    owl_file_paths = []
+    for name, namespace in (('a', 'http://a/'), ('b', 'http://b/'), ('c', 'http://a/')):
+        ttl = tmp_path / '{}.ttl'.format(name)
+        ttl.write_text(
+            '@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n'
+            '@prefix ex: <{0}> .\n'
+            'ex:{1}1 rdfs:label "{1}1" .\n'
+            'ex:{1}2 rdfs:label "{1}2" .\n'.format(namespace, name))
+        owl_file_paths.append(str(ttl))
+    for kwargs in ({'chunk_size': 1}, {'shards': 2}):
+        labels = index_assets(owl_file_paths, **kwargs)['label']
+        for uri in ('http://a/a1', 'http://a/a2', 'http://b/b1', 'http://b/b2', 'http://a/c1', 'http://a/c2'):
+            assert '"<{}>"'.format(uri) in labels
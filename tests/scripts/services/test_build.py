@@ -0,0 +1,416 @@
+# coding:utf-8
+
+
+import pytest
+import gzip
+import json
+import pickle
+import shutil
+from os import path
+from rdflib.term import URIRef
+from rdflib.graph import Graph
+from rdflib.plugins.parsers.notation3 import BadSyntax
+from umakaparser.services import build
+from umakaparser.scripts.services import index_owl, build_sbm_model
+from umakaparser.scripts.services import snapshot
+from umakaparser.scripts.services.build import (
+    PartitionExtractor, extraction_classes, extraction_properties, SBM_PREDICATES
+)
+from umakaparser.scripts.services.snapshot import snapshot_path
+from umakaparser.scripts.services.curie import CurieCompactor
+from umakaparser.scripts.services.hierarchy import Hierarchy, iter_tree_uris
+from umakaparser.scripts.services.equivalence import EquivalenceGroups
+from umakaparser.scripts.services.model_writer import ModelWriter, has_orjson
+
+
+TARGET_PROPERTIES = {
+    URIRef('http://www.w3.org/2002/07/owl#sameAs'): 'sameAs',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#label'): 'label',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#subClassOf'): 'subClassOf',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#domain'): 'domain',
+    URIRef('http://www.w3.org/2000/01/rdf-schema#range'): 'range',
+}
+
+
+@pytest.fixture
+def build_dir(fixture_dir):
+    return path.join(fixture_dir, 'build')
+
+
+@pytest.fixture
+def make_assets(build_dir, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+
+    def make(asset_format='jsonl', dist=None, **kwargs):
+        return index_owl([path.join(build_dir, 'ontology.ttl')], TARGET_PROPERTIES, dist or asset_format,
+                         asset_format=asset_format, **kwargs)
+    return make
+
+
+@pytest.fixture
+def build_model(build_dir, tmp_path):
+    def build(assets_dir, **kwargs):
+        dist = str(tmp_path / 'model.json')
+        assert build_sbm_model(path.join(build_dir, 'sbm.ttl'), assets_dir, dist, **kwargs) == dist
+        with open(dist) as fp:
+            return json.load(fp)
+    return build
+
+
+def normalize_structure(nodes):
+    return sorted(
+        ({'uri': node['uri'], 'children': normalize_structure(node.get('children', []))} for node in nodes),
+        key=lambda node: node['uri'])
+
+
+def test_build_sbm_model(make_assets, build_model):
+    model = build_model(make_assets())
+
+    assert set(model['classes']) >= {'ex:Cat', 'ex:Dog', 'ex:Kitten', 'ex:Person', 'ex:Animal'}
+    assert model['classes']['ex:Cat']['entities'] == 120
+    assert sorted(model['classes']['ex:Dog']['subClassOf']) == ['ex:Animal', 'ex:Carnivore']
+    assert set(map(tuple, model['classes']['ex:Person']['rhs'])) == {
+        ('ex:name', None), ('ex:owns', 'ex:Cat'), ('ex:owns', 'ex:Dog')}
+    assert model['classes']['ex:Cat']['lhs'] == [['ex:Person', 'ex:owns']]
+    assert [p['uri'] for p in model['properties']] == ['ex:name', 'ex:owns']
+    assert model['labels']['ex:Cat'] == {'en': 'Cat', 'ja': 'ネコ'}
+    # ラベルはモデルに現れるクラス、プロパティ、データ型の分だけ。
+    assert set(model['labels']) <= set(model['classes']) | {'ex:name', 'ex:owns', 'xsd:string'}
+    assert 'ex:Rock' not in model['labels']
+    # 目的語のデータ型のラベルも出す。
+    assert model['labels']['xsd:string'] == {'en': 'string'}
+    assert model['meta_data']['triples'] == 1200
+    assert model['meta_data']['classes'] == len(model['classes'])
+
+
+def test_build_sbm_model_unsorted_labels(make_assets, build_model):
+    expected = build_model(make_assets())['labels']
+    # 以前のbuild-indexはワーカーの出力をつなげただけなので、同じ主語の行が離れていることがある。
+    assets_dir = make_assets(dist='unsorted')
+    label_path = path.join(assets_dir, 'label')
+    with open(label_path) as fp:
+        rows = sorted(fp, key=lambda row: json.loads(row)['o'])
+    with open(label_path, 'w') as fp:
+        fp.writelines(rows)
+    assert build_model(assets_dir)['labels'] == expected
+
+
+def test_build_sbm_model_sqlite(make_assets, build_model):
+    expected = build_model(make_assets())
+    model = build_model(make_assets('sqlite'))
+
+    assert normalize_structure(model['inheritance_structure']) == \
+        normalize_structure(expected['inheritance_structure'])
+    assert model['classes'] == expected['classes']
+    assert model['properties'] == expected['properties']
+    assert model['labels'] == expected['labels']
+
+
+def test_build_sbm_model_binary(make_assets, build_model):
+    expected = build_model(make_assets())
+    model = build_model(make_assets('binary'))
+
+    assert normalize_structure(model['inheritance_structure']) == \
+        normalize_structure(expected['inheritance_structure'])
+    assert model['classes'] == expected['classes']
+    assert model['labels'] == expected['labels']
+
+
+def test_build_sbm_model_compressed(build_dir, make_assets, build_model, tmp_path):
+    expected = build_model(make_assets())
+    sbm_path = str(tmp_path / 'sbm.ttl.gz')
+    with open(path.join(build_dir, 'sbm.ttl'), 'rb') as src, gzip.open(sbm_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    dist = str(tmp_path / 'compressed.json')
+    assert build_sbm_model(sbm_path, 'jsonl', dist) == dist
+    with open(dist) as fp:
+        model = json.load(fp)
+    assert model['classes'] == expected['classes']
+    assert model['properties'] == expected['properties']
+
+
+def test_build_sbm_model_for_sbm(build_dir, make_assets, build_model):
+    expected = build_model(make_assets('sqlite'))
+    assets_dir = make_assets(dist='pruned', sbm_file=path.join(build_dir, 'sbm.ttl'))
+    with open(path.join(assets_dir, 'label')) as fp:
+        labels = [json.loads(row)['s'] for row in fp]
+    assert '<http://example.org/zoo#Cat>' in labels
+    assert '<http://example.org/zoo#Feline>' in labels
+    assert '<http://example.org/zoo#Rock>' not in labels
+    assert '<http://www.w3.org/2001/XMLSchema#string>' in labels
+
+    model = build_model(assets_dir)
+    assert model['classes'] == expected['classes']
+    assert model['properties'] == expected['properties']
+    assert model['labels'] == expected['labels']
+
+
+def test_partition_extractor(build_dir):
+    graph = Graph()
+    graph.parse(path.join(build_dir, 'sbm.ttl'), format='turtle')
+    extractor = PartitionExtractor(graph)
+
+    classes = extraction_classes(extractor)
+    assert [(c.uri, c.entities) for c in classes] == [
+        ('ex:Cat', 120), ('ex:Dog', 80), ('ex:Kitten', 15), ('ex:Person', 300)]
+    assert not hasattr(classes[0], '__dict__')
+
+    properties = extraction_properties(extractor)
+    assert [(p.uri, p.triples) for p in properties] == [('ex:owns', 210), ('ex:name', 300)]
+    owns = properties[0]
+    assert [tuple(r) for r in owns.class_relations] == [
+        (130, 'ex:Person', 'ex:Cat', None), (80, 'ex:Person', 'ex:Dog', None)]
+    assert properties[1].class_relations[0].object_datatype == 'xsd:string'
+    with pytest.raises(AttributeError):
+        owns.class_relations[0].triples = 0
+
+
+def test_curie_compactor():
+    graph = Graph()
+    graph.bind('ex', 'http://example.org/zoo#')
+    graph.bind('base', 'http://example.org/')
+    graph.bind('deep', 'http://example.org/a/b')
+    compactor = CurieCompactor(graph)
+    uris = [
+        'http://example.org/zoo#Cat', 'http://example.org/Cat', 'http://example.org/a/bc',
+        'http://example.org/a/x', 'http://other.org/Cat', 'http://example.org/zoo#', 'urn:x',
+    ]
+    for uri in uris:
+        assert compactor.compact(URIRef(uri)) == URIRef(uri).n3(graph.namespace_manager).strip('<>')
+        assert compactor.compact_n3('<{}>'.format(uri)) == compactor.compact(URIRef(uri))
+
+
+def test_hierarchy():
+    # ひし形の継承では共通の上位クラスの部分木を共有する。
+    hierarchy = Hierarchy({'D': ['B', 'C'], 'B': ['A'], 'C': ['A']}, lambda uri: uri)
+    hierarchy.climb('D')
+    tree, = hierarchy.trees()
+    assert tree['uri'] == 'A'
+    assert sorted(child['uri'] for child in tree['children']) == ['B', 'C']
+    assert tree['children'][0]['children'] == tree['children'][1]['children'] == [{'uri': 'D'}]
+    assert list(iter_tree_uris([tree]))[0] == 'A'
+    assert sorted(iter_tree_uris([tree])) == ['A', 'B', 'C', 'D']
+
+    # 参照を使う形式では、2回目以降に現れたノードは参照になる。
+    shared, = hierarchy.trees(references=True)
+    first, second = shared['children']
+    assert first['children'] == [{'uri': 'D'}]
+    assert second['children'] == [{'uri': 'D', 'ref': True}]
+
+    # 深い階層でも再帰の上限に当たらない。
+    depth = 5000
+    hierarchy = Hierarchy({str(i): [str(i + 1)] for i in range(depth)}, lambda uri: uri)
+    hierarchy.climb('0')
+    assert len(list(iter_tree_uris(hierarchy.trees()))) == depth + 1
+
+    # 循環している辺は木に出さない。
+    hierarchy = Hierarchy({'C': ['B'], 'B': ['A', 'C'], 'A': []}, lambda uri: uri)
+    hierarchy.climb('C')
+    assert hierarchy.trees() == [{'uri': 'A', 'children': [{'uri': 'B', 'children': [{'uri': 'C'}]}]}]
+
+    # 循環の上にしかないクラスも、循環の中でnameが最小のノードを最上位にして木に出す。
+    hierarchy = Hierarchy({'A': ['B'], 'B': ['A']}, lambda uri: uri)
+    hierarchy.climb('A')
+    assert hierarchy.trees() == [{'uri': 'A', 'children': [{'uri': 'B'}]}]
+    assert hierarchy.trees(references=True) == [{'uri': 'A', 'children': [{'uri': 'B'}]}]
+
+    # 別の循環の下にある循環は、上の循環の下位ノードとして出す。
+    hierarchy = Hierarchy({'A': ['B', 'X'], 'B': ['A'], 'X': ['Y'], 'Y': ['X']}, lambda uri: uri)
+    hierarchy.climb('A')
+    assert hierarchy.trees() == [
+        {'uri': 'X', 'children': [{'uri': 'A', 'children': [{'uri': 'B'}]}, {'uri': 'Y'}]}]
+
+
+def test_equivalence_groups():
+    groups = EquivalenceGroups()
+    groups.union(0, 1)
+    groups.union(2, 3)
+    assert groups.members(0) == (0, 1)
+    # 既に別のグループにある項同士を結ぶと、2つのグループが1つになる。
+    groups.union(1, 2)
+    groups.union(5, 5)
+    assert groups.members(3) == (0, 1, 2, 3)
+    assert groups.members(4) == ()
+    assert groups.members(5, (5, )) == (5, )
+    assert groups.members(9, (9, )) == (9, )
+
+
+def expand_references(nodes, definitions=None):
+    if definitions is None:
+        definitions = {}
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if not node.get('ref'):
+                definitions[node['uri']] = node
+                stack.extend(node.get('children', ()))
+    return [
+        {'uri': node['uri'], 'children': expand_references(definitions[node['uri']].get('children', []), definitions)}
+        for node in nodes
+    ]
+
+
+def test_build_sbm_model_dag(make_assets, build_model):
+    assets_dir = make_assets()
+    expected = build_model(assets_dir)
+    model = build_model(assets_dir, structure='dag')
+    assert 'ref' in json.dumps(model['inheritance_structure'])
+    assert normalize_structure(expand_references(model['inheritance_structure'])) == \
+        normalize_structure(expected['inheritance_structure'])
+    assert model['classes'] == expected['classes']
+
+
+def test_build_sbm_model_load_error(make_assets, tmp_path):
+    # 読み込み中の例外は検証の失敗として隠さずに投げ直す。
+    sbm = tmp_path / 'broken.ttl'
+    sbm.write_text('@prefix ex: <http://example.org/> .\nex:a ex:b .\n')
+    assets_dir = make_assets()
+    with pytest.raises(BadSyntax):
+        build_sbm_model(str(sbm), assets_dir, str(tmp_path / 'model.json'))
+    assert not (tmp_path / 'model.json').exists()
+
+
+def test_build_sbm_model_stream(make_assets, build_model):
+    assets_dir = make_assets()
+    assert build_model(assets_dir, stream=True) == build_model(assets_dir)
+
+
+# 読み込まれると例外を投げるpickleの中身。
+class UnpickleTrap(object):
+    def __reduce__(self):
+        return exec, ("raise AssertionError('unpickled')", )
+
+
+def test_build_sbm_model_snapshot(runner, build_dir, make_assets, tmp_path, monkeypatch):
+    assets_dir = make_assets()
+    sbm_path = str(tmp_path / 'sbm.ttl')
+    shutil.copyfile(path.join(build_dir, 'sbm.ttl'), sbm_path)
+
+    # スナップショットは指定した場合だけ使う。
+    result = runner.invoke(build, [sbm_path, '--assets', assets_dir, '--dist', str(tmp_path / 'cli.json')])
+    assert result.exit_code == 0
+    assert not path.exists(snapshot_path(sbm_path))
+
+    def build_with_snapshot(name):
+        dist = str(tmp_path / name)
+        assert build_sbm_model(sbm_path, assets_dir, dist, snapshot=True) == dist
+        with open(dist) as fp:
+            return json.load(fp)
+
+    expected = build_with_snapshot('parsed.json')
+    with open(snapshot_path(sbm_path)) as fp:
+        header = json.loads(fp.readline())
+        assert header['format'] == snapshot.SNAPSHOT_FORMAT
+        assert header['triples'] == len(fp.readlines())
+
+    def fail(*args):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(snapshot, 'parse_input', fail)
+    assert build_with_snapshot('snapshot.json') == expected
+
+    # 中身が変わった場合はスナップショットを使わずにパースし直す。
+    with open(sbm_path, 'a') as fp:
+        fp.write('\n')
+    with pytest.raises(AssertionError):
+        snapshot.load_sbm(Graph(), sbm_path, SBM_PREDICATES, use_snapshot=True)
+    monkeypatch.undo()
+    assert build_with_snapshot('changed.json') == expected
+
+    # pickleなど、JSON Linesでないファイルは読み込まずに無視する。
+    key = snapshot.snapshot_key(sbm_path, SBM_PREDICATES)
+    with open(snapshot_path(sbm_path), 'wb') as fp:
+        pickle.dump(UnpickleTrap(), fp)
+    assert snapshot.read_snapshot(snapshot_path(sbm_path), key) is None
+    assert build_with_snapshot('replaced.json') == expected
+    assert snapshot.read_snapshot(snapshot_path(sbm_path), key) is not None
+
+
+def test_build_sbm_model_store(make_assets, build_model, tmp_path, monkeypatch):
+    assets_dir = make_assets()
+    expected = build_model(assets_dir)
+    store = str(tmp_path / 'sbm.sqlite')
+    assert build_model(assets_dir, store=store) == expected
+
+    # 同じSBMならストアを開き直すだけでパースしない。
+    def fail(*args):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(snapshot, 'parse_input', fail)
+    assert build_model(assets_dir, store=store) == expected
+    assert build_model(assets_dir, store=store, stream=True) == expected
+
+
+def test_build_sbm_model_writer(build_dir, make_assets, tmp_path):
+    assets_dir = make_assets()
+    sbm_path = path.join(build_dir, 'sbm.ttl')
+    dist = str(tmp_path / 'model.json')
+    assert build_sbm_model(sbm_path, assets_dir, dist) == dist
+    with open(dist) as fp:
+        text = fp.read()
+    expected = json.loads(text)
+    # 既定の出力はjson.dump(indent=2)で全体を書いた場合と同じ。
+    assert text == json.dumps(expected, indent=2, ensure_ascii=False)
+
+    compact = str(tmp_path / 'compact.json')
+    assert build_sbm_model(sbm_path, assets_dir, compact, compact=True) == compact
+    with open(compact) as fp:
+        text = fp.read()
+    assert '\n' not in text
+    assert json.loads(text) == expected
+
+    compressed = str(tmp_path / 'compressed.json')
+    assert build_sbm_model(sbm_path, assets_dir, compressed, compress=True) == compressed + '.gz'
+    with gzip.open(compressed + '.gz', 'rt', encoding='utf-8') as fp:
+        assert json.load(fp) == expected
+    assert not path.exists(compressed)
+
+
+def test_build_sbm_model_orjson(make_assets, build_model):
+    pytest.importorskip('orjson')
+    assets_dir = make_assets()
+    assert build_model(assets_dir, json_backend='orjson') == build_model(assets_dir)
+
+
+@pytest.mark.parametrize('backend', ['json', pytest.param('orjson', marks=pytest.mark.skipif(
+    not has_orjson(), reason='orjson is not installed'))])
+def test_model_writer(tmp_path, backend):
+    value = {
+        'tree': [{'uri': 'a', 'children': [{'uri': 'b'}]}, {'uri': 'c', 'children': []}],
+        'items': {None: {'x': 1}, 'ラベル': {}, 2: [None, True, 1.5]},
+        'empty': [],
+        'meta': {'name': 'x'},
+    }
+    dist = str(tmp_path / 'model.json')
+    with ModelWriter(dist, backend=backend) as writer:
+        writer.write_list('tree', value['tree'])
+        writer.write_items('items', value['items'].items())
+        writer.write_list('empty', [])
+        writer.write('meta', value['meta'])
+    with open(dist) as fp:
+        assert fp.read() == json.dumps(value, indent=2, ensure_ascii=False)
+    assert not path.exists(dist + '.tmp')
+
+
+def test_build_sbm_model_same_as(fixture_dir, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    same_as_dir = path.join(fixture_dir, 'same_as')
+    models = []
+    for asset_format in ('jsonl', 'binary', 'sqlite'):
+        assets_dir = index_owl([path.join(same_as_dir, 'ontology.ttl')], TARGET_PROPERTIES, asset_format,
+                               asset_format=asset_format)
+        dist = str(tmp_path / '{}.json'.format(asset_format))
+        build_sbm_model(path.join(same_as_dir, 'sbm.ttl'), assets_dir, dist)
+        with open(dist) as fp:
+            models.append(fp.read())
+    # assetの形式(項を読む順番)に依らず同じモデルになる。
+    assert models[1] == models[0]
+    assert models[2] == models[0]
+
+    model = json.loads(models[0])
+    # ex:Houndは上位クラスを持たないので、上位クラスを持つ同じグループの項のうちURIが最小のex:Canineの上位クラスを使う。
+    assert model['classes']['ex:Hound']['subClassOf'] == ['ex:Carnivore']
+    # ex:Wolfは自身の上位クラスを使い、上位クラスのex:Canineはex:Houndとして木に出る。
+    assert model['classes']['ex:Wolf']['subClassOf'] == ['ex:Canine']
+    assert 'ex:Wolf' in list(iter_tree_uris(model['inheritance_structure']))
+    assert normalize_structure(model['inheritance_structure']) == normalize_structure([
+        {'uri': 'ex:Animal', 'children': [
+            {'uri': 'ex:Carnivore', 'children': [{'uri': 'ex:Hound', 'children': [{'uri': 'ex:Wolf'}]}]}]}])
@@ -1,147 +1,752 @@
 # coding:utf-8
 
-from rdflib.graph import Graph, URIRef, BNode
+from rdflib.graph import Graph, URIRef, BNode, Literal
 from datetime import datetime
 import tempfile
 import os
+import mmap
 from multiprocessing.pool import Pool
 from shutil import rmtree, move
 import glob
+import threading
+from queue import Queue, Empty, Full
 from itertools import chain
-from .utils import IGNORE_CLASSES, i18n_t
-import resource
+from .binary_assets import convert_to_binary
+from .sqlite_assets import convert_to_sqlite
+from .chunk_cache import ChunkCache
+from .compression import is_compressed, is_bgzf, iter_bgzf_blocks, open_input, read_bgzf_lines
+from .manifest import Manifest, describe_inputs
+from .pruning import sbm_seeds, related_terms, prune_assets
+from .scheduler import MemoryScheduler
+from .statements import iter_statement_chunks
+from .utils import IGNORE_CLASSES, PredicateFilterStore, i18n_t, is_ntriples, peak_memory
 from tqdm import tqdm
 import json
+import re
+import zlib
+import heapq
+from collections import defaultdict
 
+ON_PROPERTY = URIRef('http://www.w3.org/2002/07/owl#onProperty')
+NTRIPLES_SAMPLE_SIZE = 1 << 16
+MERGE_FAN_IN = 256
+SPOOL_BUFFER_SIZE = 1 << 24
+READ_BUFFER_SIZE = 1 << 20
+PACK_SIZE = 1 << 22
+DEFAULT_CHUNK_SIZE = 50000
+SCRATCH_NAME = 'umakaparser-index'
+BLANK_NODE_LABEL = re.compile(rb'_:[A-Za-z0-9_\-.]*[A-Za-z0-9_\-]')
+IGNORE_CLASSES_N3 = frozenset(c.n3() for c in IGNORE_CLASSES)
+PREFIX_NAME = re.compile(r'\s*@prefix\s+([^\s:]*):', re.IGNORECASE)
+NTRIPLES_IRI = r'<[^<>"{}|^`\\\s]*>'
+NTRIPLES_STATEMENT = re.compile(
+    r'(?P<s>{iri}|_:\S+)\s+(?P<p>{iri})\s+'
+    r'(?P<o>{iri}|_:\S+|"(?P<lexical>[^"\\]*)"(?:@[a-zA-Z0-9-]+|\^\^<(?P<datatype>[^<>"\\\s]*)>)?)\s*\.$'.format(
+        iri=NTRIPLES_IRI))
 
-# 複数のturtleファイルを5万tripleを1つのチャンクとして
-# テンポラリファイルに分割する。
-def separate_large_owl(owl_file_paths, maximum_lines_per_file):
-    _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
-    resource.setrlimit(resource.RLIMIT_NOFILE, (8192, hard_limit))
-    print(i18n_t('cmd.build_index.info_separating_owl'))
-    print(i18n_t('cmd.build_index.info_owl_items'))
-    fps = [open(file_path, 'r') for file_path in owl_file_paths]
-    chain_fp = chain(*fps)
-    text = None
-    count = 0
-    prefix = ''
-    temp_dir = tempfile.mkdtemp(dir=os.getcwd())
 
-    now = datetime.now()
-    temp_files = []
+# prefix宣言の名前。名前を読めない宣言はそれ自体を名前とする。
+def prefix_name(declaration):
+    match = PREFIX_NAME.match(declaration)
+    return match.group(1) if match else declaration
+
+
+# 見つけたprefix宣言を見つけた順に持つリスト。
+# prefixの今の宣言と同じ宣言は足さないので、同じprefixを宣言した多数のファイルを読んでも大きくならない。
+# 別の名前空間に宣言し直されたprefixが元の宣言に戻った場合は、その宣言をもう一度足す。
+class PrefixDeclarations(list):
+    def __init__(self, declarations=()):
+        super(PrefixDeclarations, self).__init__()
+        self.bindings = {}
+        self.text = ''
+        self.extend(declarations)
+
+    def append(self, declaration):
+        name = prefix_name(declaration)
+        if self.bindings.get(name) == declaration:
+            return
+        self.bindings[name] = declaration
+        self.text += declaration
+        super(PrefixDeclarations, self).append(declaration)
+
+    def extend(self, declarations):
+        for declaration in declarations:
+            self.append(declaration)
 
-    def output(content):
-        _, name = tempfile.mkstemp(dir=temp_dir)
-        with open(name, 'w') as temp_fp:
-            temp_fp.write(content)
-        return name
+    # declarationが既に宣言されたprefixを別の名前空間に宣言し直すものかどうか。
+    def rebinds(self, declaration):
+        name = prefix_name(declaration)
+        return name in self.bindings and self.bindings[name] != declaration
+
+
+# 複数のturtleファイルをmaximum_lines_per_file個のtripleを1つのチャンクとして分割し、
+# 切り出したチャンクから順に返す。
+# schedulerを指定した場合は、チャンクがそのchunk_bytesを超えた所でも区切る。
+# チャンクは内容を書き出さず(ファイルパス, 開始オフセット, 終了オフセット)で表す。
+# 圧縮されたファイルのオフセットは展開後のもので、BGZFのN-Triplesの場合は圧縮後のブロックのもの。
+# チャンクはファイルを跨がない。
+# ファイルは1つずつ順に開き、読み終えたら閉じる。
+# 見つけたprefix宣言はprefixesに追加していく。
+# skip_fileがTrueを返したファイルは読まずに飛ばす。
+def iter_owl_chunks(owl_file_paths, maximum_lines_per_file, prefixes, skip_file=None, scheduler=None):
+    for chunk, _ in iter_owl_payloads(owl_file_paths, maximum_lines_per_file, prefixes, skip_file, scheduler):
+        yield chunk
+
+
+# iter_owl_chunksと同じくチャンクを切り出し、(チャンク, 内容)を返す。
+# 内容はワーカーがファイルから範囲を読めない、展開しながら読んだチャンクの場合だけ返し、それ以外はNone。
+def iter_owl_payloads(owl_file_paths, maximum_lines_per_file, prefixes, skip_file=None, scheduler=None):
+    tqdm.write(i18n_t('cmd.build_index.info_separating_owl'))
+    tqdm.write(i18n_t('cmd.build_index.info_owl_items'))
     number_of_files = 1
-    for idx, row in enumerate(chain_fp):
-        row = row.strip()
-        if text is None:
-            text = ''
-            count = 0
+    now = datetime.now()
 
-        if not row or row.startswith('#'):
+    for file_path in owl_file_paths:
+        if skip_file and skip_file(file_path):
             continue
 
-        if row[0:7].lower() == '@prefix':
-            prefix += row + '\n'
+        with open(file_path, 'rb', buffering=READ_BUFFER_SIZE) as fp:
+            if is_ntriples(file_path) and not is_compressed(file_path):
+                chunks = ((chunk, None, '-') for chunk in iter_ntriples_chunks(
+                    fp, file_path, maximum_lines_per_file, scheduler))
+            elif is_ntriples(file_path) and is_bgzf(file_path):
+                chunks = ((chunk, None, '-') for chunk in iter_bgzf_chunks(
+                    fp, file_path, maximum_lines_per_file, scheduler))
+            else:
+                chunks = iter_statement_chunks(
+                    open_input(file_path, fp), file_path, maximum_lines_per_file, prefixes, scheduler,
+                    keep_data=is_compressed(file_path))
+            for chunk, data, idx in chunks:
+                tqdm.write('{} {} {}'.format(number_of_files, idx, datetime.now() - now))
+                number_of_files += 1
+                yield chunk, data
+
+
+# N-Triplesは1行が1トリプルなので、行を読まずに任意の改行位置で分割できる。
+# 先頭部分から1行の平均の長さを見積もり、おおよそmaximum_lines_per_file行ごとに区切る。
+# schedulerを指定した場合はそのchunk_bytesも超えないように区切る。
+def iter_ntriples_chunks(fp, file_path, maximum_lines_per_file, scheduler=None):
+    size = os.fstat(fp.fileno()).st_size
+    sample = fp.read(NTRIPLES_SAMPLE_SIZE)
+    chunk_size = max(len(sample) // (sample.count(b'\n') or 1), 1) * maximum_lines_per_file
+    start = 0
+    while start < size:
+        maximum_bytes = scheduler and scheduler.chunk_bytes
+        end = start + (min(chunk_size, maximum_bytes) if maximum_bytes else chunk_size)
+        if end < size:
+            fp.seek(end - 1)
+            fp.readline()
+            end = fp.tell()
+        else:
+            end = size
+        yield file_path, start, end
+        start = end
+
+
+# BGZFのN-Triplesはブロック単位で区切る。行の境界はワーカーが展開する時に合わせる。
+# 先頭のブロックから1行あたりの圧縮後のバイト数を見積もり、おおよそmaximum_lines_per_file行ごとに区切る。
+def iter_bgzf_chunks(fp, file_path, maximum_lines_per_file, scheduler=None):
+    blocks = iter_bgzf_blocks(fp)
+    chunk_size = None
+    start = end = 0
+    for offset, block_size in blocks:
+        if chunk_size is None:
+            sample = read_bgzf_lines(file_path, offset, offset + block_size)
+            chunk_size = max(block_size // (sample.count(b'\n') or 1), 1) * maximum_lines_per_file
+        maximum_bytes = scheduler and scheduler.chunk_bytes
+        if end - start >= (min(chunk_size, maximum_bytes) if maximum_bytes else chunk_size):
+            yield file_path, start, end
+            start = offset
+        end = offset + block_size
+    if start < end:
+        yield file_path, start, end
+
+
+# シャードに振り分けた文は、ワーカーが範囲を読めるようにシャードと入力ファイルの組ごとのファイルに書き出す。
+# 空白ノードのラベルはファイルごとに異なるので、入力ファイルが違う文は同じファイルに書き出さない。
+# 書き込みはまとめて行い、ワーカーに範囲を渡す前にflushで書き出す。
+class ShardSpool(object):
+    def __init__(self, spool_dir):
+        super(ShardSpool, self).__init__()
+        self.spool_dir = spool_dir
+        self.sizes = {}
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+
+    # 文を書き出し、書き出した先の(ファイルパス, 開始オフセット, 終了オフセット)を返す。
+    # file_idxは入力ファイルの番号。
+    def append(self, shard, file_idx, file_path, data):
+        ext = 'nt' if is_ntriples(file_path) else 'ttl'
+        spool_path = os.path.join(self.spool_dir, 'shard-{}-{}.{}'.format(shard, file_idx, ext))
+        if spool_path not in self.sizes:
+            # 再開した場合に前回のファイルが残っていれば作り直す。
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+            self.sizes[spool_path] = 0
+        start = self.sizes[spool_path]
+        self.sizes[spool_path] += len(data)
+        self.buffers[spool_path].append(data)
+        self.buffered += len(data)
+        if self.buffered >= SPOOL_BUFFER_SIZE:
+            self.flush()
+        return spool_path, start, start + len(data)
+
+    # spool_pathsを指定した場合はそのファイルの分だけ書き出す。
+    def flush(self, spool_paths=None):
+        for spool_path in list(self.buffers) if spool_paths is None else spool_paths:
+            buffer = self.buffers.pop(spool_path, None)
+            if not buffer:
+                continue
+            with open(spool_path, 'ab') as fp:
+                fp.writelines(buffer)
+            self.buffered -= sum(len(data) for data in buffer)
+
+
+# シャードごとのまだワーカーに渡していない範囲。
+# 書き出し先のファイルごとに1つの範囲を持ち、範囲の文の数とバイト数の合計を数える。
+class PendingShard(object):
+    def __init__(self):
+        super(PendingShard, self).__init__()
+        self.ranges = {}
+        self.statements = 0
+        self.size = 0
+
+    def add(self, spool_path, start, end):
+        self.statements += 1
+        self.size += end - start
+        if spool_path in self.ranges:
+            start = self.ranges[spool_path][0]
+        self.ranges[spool_path] = (start, end)
+
+    def chunk(self):
+        ranges = tuple((spool_path, start, end) for spool_path, (start, end) in self.ranges.items())
+        return ranges if len(ranges) > 1 else ranges[0]
+
+
+# 全ての文を主語のハッシュでshards個のシャードに振り分ける。
+# 同じ主語の記述は同じシャードに入るので、同じサブチャンクに入った記述はまとめて処理される。
+# 空白ノードのラベルは最初に参照した文と同じシャードに寄せ、
+# 空白ノードを主語とする記述も参照元と同じシャードで処理する。
+# 文はspool_dirのシャードごとのファイルに書き出し、そのファイルの範囲として扱う。
+# シャードはmaximum_lines_per_file個の文か、schedulerを指定した場合はそのchunk_bytesを超えた所で
+# サブチャンクに区切り、読みながら順に返す。
+# サブチャンクは1つのバイト範囲か、複数の入力ファイルにまたがる場合はバイト範囲のタプル。
+# prefixが別の名前空間に宣言し直された場合は、それまでのturtleの文を先に返して前の宣言で読めるようにする。
+def iter_subject_shards(owl_file_paths, shards, prefixes, spool_dir, maximum_lines_per_file=DEFAULT_CHUNK_SIZE,
+                        scheduler=None):
+    tqdm.write(i18n_t('cmd.build_index.info_separating_owl'))
+    spool = ShardSpool(spool_dir)
+    pending = {}
+
+    def cut(shard):
+        pending_shard = pending.pop(shard)
+        spool.flush(pending_shard.ranges)
+        return pending_shard.chunk()
+
+    def add(shard, file_idx, file_path, statement):
+        spool_path, start, end = spool.append(shard, file_idx, file_path, b''.join(statement))
+        pending_shard = pending.setdefault(shard, PendingShard())
+        pending_shard.add(spool_path, start, end)
+        maximum_bytes = scheduler and scheduler.chunk_bytes
+        if pending_shard.statements >= maximum_lines_per_file or \
+                (maximum_bytes and pending_shard.size >= maximum_bytes):
+            return cut(shard)
+        return None
+
+    for file_idx, file_path in enumerate(owl_file_paths):
+        blank_nodes = {}
+        with open(file_path, 'rb', buffering=READ_BUFFER_SIZE) as raw, open_input(file_path, raw) as fp:
+            subject = None
+            statement = []
+            for raw_row in fp:
+                row = raw_row.strip()
+                if subject is None:
+                    if not row or row.startswith(b'#'):
+                        continue
+                    if row[0:7].lower() == b'@prefix':
+                        declaration = row.decode('utf-8') + '\n'
+                        if prefixes.rebinds(declaration):
+                            for shard in sorted(pending):
+                                if any(not is_ntriples(spool_path) for spool_path in pending[shard].ranges):
+                                    yield cut(shard)
+                        prefixes.append(declaration)
+                        continue
+                    subject = row.split(None, 1)[0]
+                    shard = blank_nodes.get(subject)
+                    if shard is None:
+                        shard = zlib.crc32(subject) % shards
+                statement.append(raw_row)
+                for label in BLANK_NODE_LABEL.findall(row):
+                    blank_nodes.setdefault(label, shard)
+                if row.endswith(b' .'):
+                    chunk = add(shard, file_idx, file_path, statement)
+                    if chunk is not None:
+                        yield chunk
+                    subject = None
+                    statement = []
+            if subject is not None:
+                chunk = add(shard, file_idx, file_path, statement)
+                if chunk is not None:
+                    yield chunk
+
+    for shard in sorted(pending):
+        yield cut(shard)
+
+
+def separate_large_owl(owl_file_paths, maximum_lines_per_file):
+    prefixes = PrefixDeclarations()
+    chunks = list(iter_owl_chunks(owl_file_paths, maximum_lines_per_file, prefixes))
+    return prefixes.text, chunks
+
+
+# チャンクのバイト範囲をタプルで返す。
+def chunk_ranges(chunk):
+    return chunk if isinstance(chunk[0], tuple) else (chunk, )
+
+
+# チャンクの先頭の範囲のファイルがorderで何番目か、その範囲の開始オフセットの順に並べるためのキー。
+# シャードの書き出し先のファイルなどorderにないファイルは最後にする。
+def chunk_order(chunk, order):
+    first = chunk_ranges(chunk)[0]
+    return order.get(first[0], len(order)), first[1]
+
+
+# 1つのチャンクに収まる小さなファイルは、シャードと同じくバイト範囲のタプルにまとめて1つのチャンクにする。
+# まとめたチャンクの合計はpack_sizeまでにする。
+# 内容を添えたチャンクとファイルの一部だけのチャンクはそのまま渡す。
+def pack_small_files(payloads, pack_size):
+    pack = []
+    pack_bytes = 0
+    for chunk, data in payloads:
+        size = chunk[2] - chunk[1]
+        packable = data is None and chunk[1] == 0 and not is_compressed(chunk[0]) and size < pack_size and \
+            size == os.path.getsize(chunk[0])
+        if pack and (not packable or pack_bytes + size > pack_size):
+            yield (tuple(pack) if len(pack) > 1 else pack[0]), None
+            pack = []
+            pack_bytes = 0
+        if not packable:
+            yield chunk, data
             continue
+        pack.append(chunk)
+        pack_bytes += size
+    if pack:
+        yield (tuple(pack) if len(pack) > 1 else pack[0]), None
 
-        text += row + '\n'
-        if row.endswith(' .'):
-            count += 1
-            if count == maximum_lines_per_file:
-                name = output(text)
-                text = None
-                temp_files.append(name)
-                print(number_of_files, idx, datetime.now() - now)
-                number_of_files += 1
-    else:
-        name = output(text)
-        temp_files.append(name)
-        print(number_of_files, idx, datetime.now() - now)
 
-    for fp in fps:
-        fp.close()
-    return prefix, temp_files, temp_dir
+# 分割処理を別スレッドで実行し、切り出したチャンクを上限付きのキューに順次渡す。
+# 各チャンクにはその時点までに見つかったprefix宣言を添える。
+# shardsを指定した場合は主語のハッシュで分けたシャードをサブチャンクに区切って渡す。
+# cacheを指定した場合はキャッシュにあるファイルを分割せずにhitsに記録する。
+# manifestを指定した場合は分割したチャンクを記録し、処理済みのチャンクは渡さない。
+# チャンクをワーカーに渡す数と大きさはschedulerが決める。
+# シャードに分ける場合は文をspool_dirに書き出す。
+# キャッシュはファイルごとの結果を保存するので、小さなファイルをまとめるのはキャッシュを使わない場合だけ。
+class ChunkProducer(threading.Thread):
+    def __init__(self, owl_file_paths, maximum_lines_per_file, scheduler, shards=None, cache=None,
+                 manifest=None, spool_dir=None):
+        super(ChunkProducer, self).__init__(daemon=True)
+        self.owl_file_paths = owl_file_paths
+        self.maximum_lines_per_file = maximum_lines_per_file
+        self.shards = shards
+        self.cache = cache
+        self.manifest = manifest
+        self.scheduler = scheduler
+        self.spool_dir = spool_dir
+        self.queue = Queue(maxsize=scheduler.workers)
+        self.prefixes = PrefixDeclarations()
+        self.error = None
+        self.cancelled = threading.Event()
+        self.hits = []
+        self.misses = {}
+        self.file_starts = []
 
+    @property
+    def prefix(self):
+        return self.prefixes.text
 
-# turtleをパースして目的のプロパティが含まれているものを抽出して
-# テンポラリファイルに書き出す。
-# サブプロセスとして実行するので外のスコープにはアクセスしない。
-def output_process(args):
-    prefix, temp_file, output_properties, base_dir = args
-    graph = Graph()
-    with open(temp_file) as fp:
-        graph.parse(format='turtle', data=prefix + fp.read())
-    output_fp = {}
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    # ファイルを読む前に呼ばれ、キャッシュにあればそのprefix宣言を足して飛ばす。
+    def skip_cached(self, file_path):
+        self.file_starts.append((file_path, len(self.prefixes)))
+        key = self.cache.key(file_path, self.prefix)
+        entry = self.cache.load(key)
+        if entry is None:
+            self.misses[file_path] = key
+            return False
+        self.prefixes.extend(entry['prefixes'])
+        self.hits.append((file_path, key, entry))
+        return True
+
+    # ファイルごとに、そのファイルの中で見つかったprefix宣言を返す。
+    def file_prefixes(self):
+        ends = [start for _, start in self.file_starts[1:]] + [len(self.prefixes)]
+        return {file_path: self.prefixes[start:end] for (file_path, start), end in zip(self.file_starts, ends)}
+
+    def run(self):
+        try:
+            if self.shards:
+                chunks = ((shard, None) for shard in iter_subject_shards(
+                    self.owl_file_paths, self.shards, self.prefixes, self.spool_dir, self.maximum_lines_per_file,
+                    self.scheduler))
+            else:
+                skip_file = self.skip_cached if self.cache else None
+                chunks = iter_owl_payloads(
+                    self.owl_file_paths, self.maximum_lines_per_file, self.prefixes, skip_file, self.scheduler)
+                if not self.cache:
+                    pack_size = self.scheduler.chunk_bytes
+                    chunks = pack_small_files(chunks, min(pack_size, PACK_SIZE) if pack_size else PACK_SIZE)
+            for chunk, data in chunks:
+                if self.cancelled.is_set():
+                    break
+                if self.manifest is not None:
+                    self.manifest.record_split(chunk)
+                    if chunk in self.manifest.done:
+                        continue
+                self.put((self.prefix, chunk, data))
+            else:
+                if self.manifest is not None:
+                    self.manifest.write(event='split_done')
+        except Exception as e:
+            self.error = e
+        finally:
+            self.put(None)
+
+    # schedulerが処理に回せると判断するまで待ちながらキューから取り出す。
+    # キャンセルされた場合は待機をやめて終了する。
+    def chunks(self):
+        while not self.cancelled.is_set():
+            try:
+                item = self.queue.get(timeout=0.1)
+            except Empty:
+                continue
+            if item is None:
+                return
+            while not self.scheduler.acquire(item[1], timeout=0.1):
+                if self.cancelled.is_set():
+                    return
+            yield item
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+# チャンクのバイト範囲だけをメモリマップして読み込む。
+# BGZFのN-Triplesはブロックの範囲を展開して読む。
+def read_chunk(chunk):
+    if is_compressed(chunk[0]):
+        return read_bgzf_lines(*chunk).decode('utf-8')
+    file_path, start, end = chunk
+    if start == end:
+        return ''
+    map_offset = start - start % mmap.ALLOCATIONGRANULARITY
+    with open(file_path, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), end - map_offset, access=mmap.ACCESS_READ, offset=map_offset) as mm:
+            return mm[start - map_offset:].decode('utf-8')
+
+
+# 目的のプロパティのトリプルをグラフから取り出し、(出力名, 主語, 目的語)をN3形式で返す。
+def graph_rows(graph, output_properties):
     for s, p, o in graph:
+        if p not in output_properties:
+            continue
         exclude_if = any([
             o in IGNORE_CLASSES,
             isinstance(o, BNode),
-            list(graph.objects(o, URIRef('http://www.w3.org/2002/07/owl#onProperty')))
+            list(graph.objects(o, ON_PROPERTY))
         ])
-        if p in output_properties and not exclude_if:
-            output = output_properties[p]
-            if output not in output_fp:
-                _, file_path = tempfile.mkstemp(dir=os.path.join(base_dir, output))
-                output_fp[output] = open(file_path, 'w')
-            fp = output_fp[output]
-            fp.write(json.dumps({'s': s.n3(), 'o': o.n3()}))
-            fp.write('\n')
-    for fp in output_fp.values():
-        fp.close()
-
-
-# ディレクトリ内のファイルを全て連結する。
+        if not exclude_if:
+            yield output_properties[p], s.n3(), o.n3()
+
+
+# 制約(owl:onPropertyを持つ名前付きのノード)をN3形式で返す。
+def graph_restrictions(graph):
+    return set(s.n3() for s in graph.subjects(ON_PROPERTY) if not isinstance(s, BNode))
+
+
+# turtleをパースして目的のプロパティが含まれているものを抽出する。
+# 戻り値は抽出した行とチャンク内で見つけた制約。
+def turtle_rows(prefix, data, output_properties):
+    # 目的のプロパティと制約の判定に使うowl:onPropertyだけを残してパースする。
+    graph = Graph(store=PredicateFilterStore(chain(output_properties, [ON_PROPERTY])))
+    graph.parse(format='turtle', data=prefix + data)
+    return list(graph_rows(graph, output_properties)), graph_restrictions(graph)
+
+
+# N-Triplesを1行ずつ字句解析して目的のプロパティが含まれているものを抽出する。
+# rdflibのグラフは作らない。
+# エスケープを含む行などパターンに合わない行はまとめてturtleとしてパースする。
+# 戻り値は抽出した行とチャンク内で見つけたprefix宣言と制約。
+def ntriples_rows(prefix, data, output_properties):
+    targets = {p.n3(): output for p, output in output_properties.items()}
+    on_property = ON_PROPERTY.n3()
+    rows = []
+    restrictions = set()
+    prefixes = []
+    rest = []
+    for line in data.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line[0:7].lower() == '@prefix':
+            prefixes.append(line + '\n')
+            continue
+        match = NTRIPLES_STATEMENT.match(line)
+        if match is None:
+            rest.append(line + '\n')
+            continue
+        s, p, o, lexical, datatype = match.groups()
+        if p == on_property:
+            if not s.startswith('_:'):
+                restrictions.add(s)
+            continue
+        output = targets.get(p)
+        if output is None or o.startswith('_:') or o in IGNORE_CLASSES_N3:
+            continue
+        if datatype:
+            o = Literal(lexical, datatype=URIRef(datatype)).n3()
+        rows.append((output, s, o))
+
+    if rest:
+        graph = Graph(store=PredicateFilterStore(chain(output_properties, [ON_PROPERTY])))
+        graph.parse(format='turtle', data=prefix + ''.join(prefixes) + ''.join(rest))
+        restrictions.update(graph_restrictions(graph))
+        rows.extend(graph_rows(graph, output_properties))
+
+    # グラフと同じく同じトリプルはチャンク内で1つにまとめる。
+    return [row for row in dict.fromkeys(rows) if row[2] not in restrictions], prefixes, restrictions
+
+
+# 抽出した行をプロパティごとのテンポラリファイルに書き出す。
+# 各ファイルは重複を除いてソートしておき、結合時にマージできるようにする。
+# 戻り値はプロパティごとの書き出したファイル。
+def write_rows(rows, base_dir):
+    output_files = {}
+    outputs = defaultdict(set)
+    for output, s, o in rows:
+        outputs[output].add(json.dumps({'s': s, 'o': o}) + '\n')
+    for output, lines in outputs.items():
+        fd, file_path = tempfile.mkstemp(dir=os.path.join(base_dir, output))
+        with os.fdopen(fd, 'w') as fp:
+            fp.writelines(sorted(lines))
+        output_files[output] = file_path
+    return output_files
+
+
+# チャンクから目的のプロパティが含まれているものを抽出して
+# テンポラリファイルに書き出す。
+# チャンクは1つのバイト範囲か、シャードやまとめた小さなファイルの場合はバイト範囲のタプル。
+# dataはファイルから読み直せない、展開しながら読んだチャンクの内容。
+# 空白ノードのラベルはファイルごとに異なるので、ファイルごとに分けてパースする。
+# N-Triplesのファイルは専用の字句解析で処理する。
+# サブプロセスとして実行するので外のスコープにはアクセスしない。
+# 戻り値はチャンク、N-Triples中で見つけたprefix宣言、制約、書き出したファイル、処理中に増えたメモリ。
+# 制約はチャンクを跨いで参照されうるので、結合時に全体で除外する。
+def output_process(args):
+    prefix, chunk, output_properties, base_dir, data = args
+    memory = peak_memory()
+    texts = defaultdict(list)
+    if data is not None:
+        texts[chunk[0]].append(data.decode('utf-8'))
+    else:
+        for r in chunk_ranges(chunk):
+            texts[r[0]].append(read_chunk(r))
+    rows, prefixes, restrictions = [], [], set()
+    for file_path, file_texts in texts.items():
+        if is_ntriples(file_path):
+            file_rows, file_prefixes, file_restrictions = ntriples_rows(
+                prefix, '\n'.join(file_texts), output_properties)
+            prefixes.extend(file_prefixes)
+        else:
+            file_rows, file_restrictions = turtle_rows(prefix, '\n'.join(file_texts), output_properties)
+        rows.extend(file_rows)
+        restrictions.update(file_restrictions)
+    return {
+        'chunk': chunk,
+        'prefixes': prefixes,
+        'restrictions': restrictions,
+        'outputs': write_rows(rows, base_dir),
+        'memory': peak_memory() - memory,
+    }
+
+
+# ソート済みのファイルをk-wayマージし、重複を除いてoutput_fileに書き出す。
+# 目的語がrestrictionsに含まれる行は除外する。
+def merge_runs(run_files, output_file, restrictions=()):
+    fps = [open(run_file) for run_file in run_files]
+    try:
+        with open(output_file, 'w') as output_fp:
+            previous = None
+            for row in heapq.merge(*fps):
+                if row == previous:
+                    continue
+                previous = row
+                if restrictions and json.loads(row)['o'] in restrictions:
+                    continue
+                output_fp.write(row)
+    finally:
+        for fp in fps:
+            fp.close()
+
+
+# ディレクトリ内のファイルを全てマージして1つのassetにする。
+# 同時に開くファイルがMERGE_FAN_IN個を超える場合は段階的にマージする。
+# 途中で止まっても再開できるように、ワーカーの出力ファイルは消さない。
+# 目的語がrestrictionsに含まれる行は除外する。
 # サブプロセスとして実行するので外のスコープにはアクセスしない。
 def join_process(args):
-    base_dir, temp_dir, op = args
+    base_dir, temp_dir, op, restrictions = args
     temp_path = os.path.join(temp_dir, op)
-    files = glob.glob1(temp_path, 'tmp*')
+    files = [os.path.join(temp_path, f) for f in glob.glob1(temp_path, 'tmp*')]
     if not files:
         os.rmdir(temp_path)
         return
 
-    num, temp_file = tempfile.mkstemp(dir=temp_dir)
-    text = ""
-    for file_path in files:
-        file_path = os.path.join(temp_path, file_path)
-        with open(file_path, 'r') as fp:
-            for row in fp:
-                text += row
-    with open(temp_file, 'w') as fp:
-        fp.write(text)
+    run_files = set(files)
+    while len(files) > MERGE_FAN_IN:
+        merged_files = []
+        for idx in range(0, len(files), MERGE_FAN_IN):
+            inputs = files[idx:idx + MERGE_FAN_IN]
+            fd, merged_file = tempfile.mkstemp(dir=temp_path)
+            os.close(fd)
+            merge_runs(inputs, merged_file)
+            for input_file in inputs:
+                if input_file not in run_files:
+                    os.remove(input_file)
+            merged_files.append(merged_file)
+        files = merged_files
 
+    fd, temp_file = tempfile.mkstemp(dir=temp_dir)
+    os.close(fd)
+    merge_runs(files, temp_file, restrictions)
     move(temp_file, os.path.join(base_dir, op))
 
 
-def index_owl(owl_file_paths, output_properties, dist):
-    maximum_lines_per_file = 50000
-    prefix, temp_files, temp_dir = separate_large_owl(owl_file_paths, maximum_lines_per_file)
-    base_dir = os.path.join(os.getcwd(), dist)
+# 分割したファイルごとの処理結果をキャッシュに保存する。
+def store_cache(cache, producer, results):
+    file_prefixes = producer.file_prefixes()
+    for file_path, key in producer.misses.items():
+        file_results = sorted((r for r in results if r['chunk'][0] == file_path), key=lambda r: r['chunk'][1])
+        outputs = defaultdict(list)
+        for result in file_results:
+            for output, output_file in result['outputs'].items():
+                outputs[output].append(output_file)
+        cache.store(
+            key,
+            file_prefixes.get(file_path, []),
+            [prefix for result in file_results for prefix in result['prefixes']],
+            set().union(*(result['restrictions'] for result in file_results)),
+            outputs)
 
-    if os.path.exists(base_dir):
-        rmtree(base_dir)
 
+# 前回の記録を読み込み、処理が終わっていないチャンクが書き出したファイルを消す。
+def prepare_resume(manifest, description, temp_dir, output_properties):
+    manifest.load(description)
+    done_files = manifest.done_files()
     for output_property in output_properties.values():
-        os.mkdir(os.path.join(temp_dir, output_property))
+        output_dir = os.path.join(temp_dir, output_property)
+        for name in os.listdir(output_dir):
+            file_path = os.path.join(output_dir, name)
+            if file_path not in done_files:
+                os.remove(file_path)
+
+
+# scratch_dirを指定した場合は作業ディレクトリをその中に作り、進み具合をマニフェストに記録する。
+# 失敗した時は作業ディレクトリを残すので、resumeを指定して再実行すると処理済みのチャンクを飛ばせる。
+# max_memory(バイト)を指定した場合はワーカーのメモリの合計がその範囲に収まるようにチャンクを渡す。
+# ワーカーのメモリを正しく測れるように、ワーカーはチャンクごとに作り直す。
+# sbm_fileを指定した場合は、そのSBMのクラスとプロパティからsameAsとsubClassOfで辿れる項の行だけを書き出す。
+def index_owl(owl_file_paths, output_properties, dist, shards=None, asset_format='jsonl', cache_dir=None,
+              scratch_dir=None, resume=False, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, max_memory=None,
+              sbm_file=None):
+    maximum_lines_per_file = chunk_size
+    workers = workers or os.cpu_count() or 1
+    manifest = None
+    if scratch_dir:
+        temp_dir = os.path.join(os.path.abspath(scratch_dir), SCRATCH_NAME)
+        if not resume and os.path.exists(temp_dir):
+            rmtree(temp_dir)
+        os.makedirs(temp_dir, exist_ok=True)
+        manifest = Manifest(temp_dir)
+    else:
+        temp_dir = tempfile.mkdtemp(dir=os.getcwd())
+    base_dir = os.path.join(os.getcwd(), dist)
 
-    os.mkdir(base_dir)
-    print(i18n_t('cmd.build_index.info_collecting_info'))
+    for output_property in output_properties.values():
+        os.makedirs(os.path.join(temp_dir, output_property), exist_ok=True)
+
+    succeeded = False
     try:
-        p = Pool()
-        with tqdm(total=len(temp_files)) as pbar:
-            for _ in p.imap_unordered(output_process, ((prefix, temp_file, output_properties, temp_dir) for temp_file in temp_files)):
-                pbar.update(1)
+        seeds = sbm_seeds(sbm_file) if sbm_file else None
+        if manifest is not None:
+            description = describe_inputs(owl_file_paths, output_properties, maximum_lines_per_file, shards)
+            prepare_resume(manifest, description, temp_dir, output_properties)
+            manifest.open(description)
+
+        if os.path.exists(base_dir):
+            rmtree(base_dir)
+        os.mkdir(base_dir)
+        print(i18n_t('cmd.build_index.info_collecting_info'))
+
+        # シャードは複数のファイルにまたがるので、キャッシュはチャンクに分ける場合だけ使う。
+        cache = ChunkCache(cache_dir, output_properties) if cache_dir and not shards else None
+        scheduler = MemoryScheduler(workers, max_memory)
+        producer = ChunkProducer(
+            owl_file_paths, maximum_lines_per_file, scheduler, shards, cache, manifest, spool_dir=temp_dir)
+        producer.start()
+        tasks = ((prefix, chunk, output_properties, temp_dir, data) for prefix, chunk, data in producer.chunks())
+        results = list(manifest.done.values()) if manifest is not None else []
+        with Pool(workers, maxtasksperchild=1 if max_memory else None) as p, tqdm(initial=len(results)) as pbar:
+            try:
+                for result in p.imap_unordered(output_process, tasks):
+                    if manifest is not None:
+                        manifest.record_done(result)
+                    results.append(result)
+                    scheduler.release(result)
+                    pbar.update(1)
+            finally:
+                producer.cancel()
+        producer.join()
+        if producer.error:
+            raise producer.error
+
+        ntriples_prefixes = {r['chunk']: r['prefixes'] for r in results if r['prefixes']}
+        restrictions = set().union(*(r['restrictions'] for r in results))
+        if cache is not None:
+            store_cache(cache, producer, results)
+            for file_path, key, entry in producer.hits:
+                cache.restore(key, entry, temp_dir)
+                restrictions.update(entry['restrictions'])
+                if entry['ntriples_prefixes']:
+                    ntriples_prefixes[(file_path, 0)] = entry['ntriples_prefixes']
+
         for op in output_properties.values():
-            join_process((base_dir, temp_dir, op))
+            join_process((base_dir, temp_dir, op, restrictions))
+        if seeds is not None:
+            prune_assets(base_dir, output_properties.values(), related_terms(base_dir, seeds))
+        if asset_format == 'binary':
+            convert_to_binary(base_dir, output_properties.values())
+        elif asset_format == 'sqlite':
+            convert_to_sqlite(base_dir, output_properties.values())
+        # N-Triples中のprefix宣言はファイルの順に後ろに足し、同じ宣言は1つにまとめる。
+        prefixes = PrefixDeclarations(producer.prefixes)
+        order = {file_path: idx for idx, file_path in enumerate(owl_file_paths)}
+        for chunk in sorted(ntriples_prefixes, key=lambda c: chunk_order(c, order)):
+            prefixes.extend(ntriples_prefixes[chunk])
         with open(os.path.join(base_dir, 'prefix.ttl'), 'w') as fp:
-            fp.write(prefix)
+            fp.write(prefixes.text)
+        succeeded = True
     finally:
-        rmtree(temp_dir)
+        if manifest is not None:
+            manifest.close()
+        if succeeded or manifest is None:
+            rmtree(temp_dir)
 
     return base_dir
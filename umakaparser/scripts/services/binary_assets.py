@@ -0,0 +1,113 @@
+# coding:utf-8
+
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+from .utils import TermDictionary
+
+# バイナリ形式のasset
+# terms.bin: 全プロパティで共有する項の表。
+#   ヘッダ(マジック, 項の数)、各項の開始オフセット(uint64 × (項の数 + 1))、UTF-8の項(N3形式)を連結したもの。
+# <プロパティ名>.bin: (主語のID, 目的語のID)をuint32で並べたもの。
+# 数値は全てリトルエンディアン。
+TERMS_FILE = 'terms.bin'
+TERMS_MAGIC = b'UMKT'
+TERMS_HEADER = struct.Struct('<4sI')
+PAIRS_SUFFIX = '.bin'
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def write_term_table(path, terms):
+    offsets = array('Q', [0])
+    encoded = []
+    for term in terms:
+        data = term.encode('utf-8')
+        encoded.append(data)
+        offsets.append(offsets[-1] + len(data))
+    with open(path, 'wb') as fp:
+        fp.write(TERMS_HEADER.pack(TERMS_MAGIC, len(encoded)))
+        _little_endian(offsets).tofile(fp)
+        for data in encoded:
+            fp.write(data)
+
+
+# JSON Linesのassetをバイナリ形式に変換する。
+# 項の表は全てのプロパティで共有し、変換後は元のファイルを削除する。
+def convert_to_binary(base_dir, output_names):
+    terms = TermDictionary()
+    for name in output_names:
+        path = os.path.join(base_dir, name)
+        if not os.path.exists(path):
+            continue
+        pairs = array('I')
+        with open(path) as fp:
+            for row in fp:
+                obj = json.loads(row)
+                pairs.append(terms.intern(obj['s']))
+                pairs.append(terms.intern(obj['o']))
+        with open(path + PAIRS_SUFFIX, 'wb') as fp:
+            _little_endian(pairs).tofile(fp)
+        os.remove(path)
+    write_term_table(os.path.join(base_dir, TERMS_FILE), terms.terms)
+
+
+def is_binary_assets(assets_dir):
+    return os.path.exists(os.path.join(assets_dir, TERMS_FILE))
+
+
+def _map_file(path):
+    with open(path, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _cast(view, fmt):
+    values = view.cast(fmt)
+    if sys.byteorder == 'big':
+        values = array(fmt, values)
+        values.byteswap()
+    return values
+
+
+# メモリマップした項の表。項はIDで引いた時に初めてデコードする。
+class TermTable(object):
+    def __init__(self, path):
+        super(TermTable, self).__init__()
+        self._mm = _map_file(path)
+        magic, count = TERMS_HEADER.unpack_from(self._mm, 0)
+        if magic != TERMS_MAGIC:
+            raise ValueError('{} is not a term table.'.format(path))
+        start = TERMS_HEADER.size
+        self._blob = start + 8 * (count + 1)
+        self._offsets = _cast(memoryview(self._mm)[start:self._blob], 'Q')
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, term_id):
+        start = self._blob + self._offsets[term_id]
+        end = self._blob + self._offsets[term_id + 1]
+        return self._mm[start:end].decode('utf-8')
+
+
+# メモリマップした(主語のID, 目的語のID)の組を順に返す。
+def read_pairs(path):
+    try:
+        mm = _map_file(path)
+    except IOError:
+        return
+    if mm is None:
+        return
+    ids = _cast(memoryview(mm), 'I')
+    for idx in range(0, len(ids), 2):
+        yield ids[idx], ids[idx + 1]
@@ -1,18 +1,27 @@
 # coding:utf-8
 
-from collections import defaultdict
+from array import array
+from collections import defaultdict, namedtuple
 from rdflib import URIRef
 from rdflib.graph import Graph
 from rdflib.namespace import OWL, SKOS, DOAP, FOAF, DC, DCTERMS, VOID
 from isodate import parse_datetime
 import os
 import json
-from .utils import parse_literal, i18n_t
+from .utils import PredicateFilterStore, TermDictionary, parse_literal, i18n_t
+from .snapshot import load_sbm
+from .sqlite_store import SQLiteStore
+from .curie import CurieCompactor
+from .hierarchy import Hierarchy, iter_tree_uris
+from .equivalence import EquivalenceGroups
+from .model_writer import ModelWriter
 from tqdm import tqdm
 import threading
 import sys
 import time
 from .validate import validate_graph, validate_namespace_duplication, GraphValidationError
+from .binary_assets import is_binary_assets, read_pairs, TermTable, TERMS_FILE, PAIRS_SUFFIX
+from .sqlite_assets import is_sqlite_assets, SQLiteAssets, ASSETS_DB
 
 RDFS_CLASS = URIRef('http://rdfs.org/ns/void#class')
 RDFS_ENTITIES = URIRef('http://rdfs.org/ns/void#entities')
@@ -29,31 +38,60 @@ class ClassResource(object):
         self.label = []
         self.subClassOf = None
 
-    def serialize(self):
+    def serialize(self, terms):
         result = {}
         if self.subClassOf:
             result['subClassOf'] = self.subClassOf
         return result
 
 
-class SMBResource(object):
-    def __init__(self, graph, node):
-        super(SMBResource, self).__init__()
-        self._graph = graph
-        self._node = node
+RDFS_PROPERTY = URIRef('http://rdfs.org/ns/void#property')
+RDFS_TRIPLES = URIRef('http://rdfs.org/ns/void#triples')
+CLASS_PARTITION = URIRef('http://rdfs.org/ns/void#classPartition')
+PROPERTY_PARTITION = URIRef('http://rdfs.org/ns/void#propertyPartition')
+CLASS_RELATION = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#classRelation')
+OBJECT_CLASS = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#objectClass')
+OBJECT_DATATYPE = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#objectDatatype')
+SUBJECT_CLASS = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#subjectClass')
+ENDPOINT = URIRef('http://www.w3.org/ns/sparql-service-description#endpoint')
+DEFAULT_DATASET = URIRef('http://www.w3.org/ns/sparql-service-description#defaultDataset')
+CRAWL_LOG = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#crawlLog')
+CRAWL_START_TIME = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#crawlStartTime')
+# パーティションとクラス間の関係を作るのに使う述語
+PARTITION_PREDICATES = (
+    CLASS_PARTITION, PROPERTY_PARTITION, RDFS_CLASS, RDFS_ENTITIES, RDFS_PROPERTY, RDFS_TRIPLES,
+    CLASS_RELATION, OBJECT_CLASS, OBJECT_DATATYPE, SUBJECT_CLASS,
+)
+# モデルの作成と検証に使う述語。SBMを読む時はこれ以外のトリプルを捨てる。
+SBM_PREDICATES = PARTITION_PREDICATES + (ENDPOINT, DEFAULT_DATASET, CRAWL_LOG, CRAWL_START_TIME)
+# 目的語がモデルに出る項(クラス、プロパティ、データ型)になる述語
+SBM_TERM_PREDICATES = (RDFS_CLASS, RDFS_PROPERTY, SUBJECT_CLASS, OBJECT_CLASS, OBJECT_DATATYPE)
+PAIR_SHIFT = 32
+PAIR_MASK = (1 << PAIR_SHIFT) - 1
+
+
+# 2つの項のIDを1つの整数に詰める。
+def pack_pair(a, b):
+    return a << PAIR_SHIFT | b
+
 
-    def serialize(self):
-        return {}
+def unpack_terms(terms, pair):
+    return terms.term(pair >> PAIR_SHIFT), terms.term(pair & PAIR_MASK)
 
 
-class SBMClassPartition(SMBResource):
+class SBMClassPartition(object):
+    __slots__ = ('uri', 'entities', 'label', 'subClassOf', 'rhs', 'lhs')
 
-    def __init__(self, graph, node):
-        super(SBMClassPartition, self).__init__(graph, node)
+    def __init__(self, uri, entities):
+        super(SBMClassPartition, self).__init__()
+        self.uri = uri
+        self.entities = entities
         self.label = []
         self.subClassOf = None
-        self.rhs = set()
-        self.lhs = set()
+        # (述語, 目的語のクラス)と(主語のクラス, 述語)の組を、項のIDを詰めた整数にして
+        # 追加された順に持つ。
+        self.rhs = {}
+        self.lhs = {}
 
     def __hash__(self, *args, **kwargs):
         return self.uri.__hash__()
@@ -61,18 +99,7 @@ class SBMClassPartition(SMBResource):
     def __eq__(self, other):
         return self.uri == other.uri
 
-    @property
-    def uri(self):
-        objects = [o for o in self._graph.objects(self._node, RDFS_CLASS)]
-        return objects[0].n3(self._graph.namespace_manager).strip('<>') if objects else None
-
-    @property
-    def entities(self):
-        if self._node:
-            objects = [o for o in self._graph.objects(self._node, RDFS_ENTITIES)]
-            return int(objects[0]) if objects else None
-
-    def serialize(self):
+    def serialize(self, terms):
         result = {}
 
         if self.entities:
@@ -85,55 +112,28 @@ class SBMClassPartition(SMBResource):
             result['subClassOf'] = self.subClassOf
 
         if self.rhs:
-            result['rhs'] = sorted(self.rhs, key=lambda x: x[0])
+            result['rhs'] = sorted((unpack_terms(terms, pair) for pair in self.rhs), key=lambda x: x[0])
 
         if self.lhs:
-            result['lhs'] = sorted(self.lhs, key=lambda x: x[1])
+            result['lhs'] = sorted((unpack_terms(terms, pair) for pair in self.lhs), key=lambda x: x[1])
         return result
 
 
-RDFS_PROPERTY = URIRef('http://rdfs.org/ns/void#property')
-RDFS_TRIPLES = URIRef('http://rdfs.org/ns/void#triples')
-CLASS_RELATION = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#classRelation')
-
+class SBMPropertyPartition(object):
+    __slots__ = ('uri', 'triples', 'class_relations', 'label')
 
-class SBMPropertyPartition(SMBResource):
-    RDFS_PROPERTY = URIRef('http://rdfs.org/ns/void#property')
-    RDFS_TRIPLES = URIRef('http://rdfs.org/ns/void#triples')
-    CLASS_RELATION = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#classRelation')
-
-    def __init__(self, graph, node):
-        super(SBMPropertyPartition, self).__init__(graph, node)
+    def __init__(self, uri, triples, class_relations):
+        super(SBMPropertyPartition, self).__init__()
+        self.uri = uri
+        self.triples = triples
+        self.class_relations = class_relations
         self.label = []
 
-    @property
-    def uri(self):
-        objects = [o for o in self._graph.objects(self._node, RDFS_PROPERTY)]
-        return objects[0].n3(self._graph.namespace_manager).strip('<>') if objects else None
-
-    @property
-    def triples(self):
-        objects = [o for o in self._graph.objects(self._node, RDFS_TRIPLES)]
-        return int(objects[0]) if objects else None
-
-    @property
-    def class_relations(self):
-        support_map = {}
-        for node in self._graph.objects(self._node, CLASS_RELATION):
-            relation = SBMClassRelation(self._graph, node)
-            same_relation = support_map.get((relation.triples, relation.subject_class))
-            if same_relation:
-                if None not in [same_relation.object_datatype, relation.object_class] and same_relation.object_datatype == relation.object_class:
-                    continue
-            else:
-                support_map[(relation.triples, relation.subject_class)] = relation
-        return sorted(support_map.values(), key=lambda x: x.triples, reverse=True)
-
-    def serialize(self, classes_detail):
+    def serialize(self, class_uris):
         result = {
             'uri': self.uri,
             'triples': self.triples,
-            'class_relations': [relation.serialize(classes_detail) for relation in self.class_relations]
+            'class_relations': [relation.serialize(class_uris) for relation in self.class_relations]
         }
         if self.label:
             result['label'] = labels_lang(self.label)
@@ -141,36 +141,13 @@ class SBMPropertyPartition(SMBResource):
         return result
 
 
-OBJECT_CLASS = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#objectClass')
-OBJECT_DATATYPE = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#objectDatatype')
-SUBJECT_CLASS = URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#subjectClass')
+class SBMClassRelation(namedtuple('SBMClassRelation', ('triples', 'subject_class', 'object_class', 'object_datatype'))):
+    __slots__ = ()
 
-
-class SBMClassRelation(SMBResource):
-    @property
-    def triples(self):
-        objects = [o for o in self._graph.objects(self._node, RDFS_TRIPLES)]
-        return int(objects[0]) if objects else None
-
-    @property
-    def object_class(self):
-        objects = [o for o in self._graph.objects(self._node, OBJECT_CLASS)]
-        return objects[0].n3(self._graph.namespace_manager).strip('<>') if objects else None
-
-    @property
-    def object_datatype(self):
-        objects = [o for o in self._graph.objects(self._node, OBJECT_DATATYPE)]
-        return objects[0].n3(self._graph.namespace_manager).strip('<>') if objects else None
-
-    @property
-    def subject_class(self):
-        objects = [o for o in self._graph.objects(self._node, SUBJECT_CLASS)]
-        return objects[0].n3(self._graph.namespace_manager).strip('<>') if objects else None
-
-    def serialize(self, classes_detail):
+    def serialize(self, class_uris):
         object_class = self.object_class
         object_datatype = self.object_datatype
-        if object_class not in classes_detail:
+        if object_class not in class_uris:
             object_class, object_datatype = object_datatype, object_class
         return {
             'triples': self.triples,
@@ -180,36 +157,136 @@ class SBMClassRelation(SMBResource):
         }
 
 
+# 同じ件数と主語クラスの関係は最初のものだけを残し、件数の多い順に並べる。
+def unique_class_relations(relations):
+    support_map = {}
+    for relation in relations:
+        same_relation = support_map.get((relation.triples, relation.subject_class))
+        if same_relation:
+            if None not in [same_relation.object_datatype, relation.object_class] and \
+                    same_relation.object_datatype == relation.object_class:
+                continue
+        else:
+            support_map[(relation.triples, relation.subject_class)] = relation
+    return tuple(sorted(support_map.values(), key=lambda x: x.triples, reverse=True))
+
+
+# SBMのパーティションとクラス間の関係を1回の走査で取り出す。
+# 必要な述語のトリプルだけを主語ごとにまとめ、レコードはそこから1度だけ作る。
+# 項はcompactor(指定しない場合はグラフのprefixで作ったもの)でCURIEにする。
+class PartitionExtractor(object):
+    def __init__(self, graph, compactor=None):
+        super(PartitionExtractor, self).__init__()
+        self.compact = (compactor or CurieCompactor(graph)).compact
+        self.values = defaultdict(lambda: defaultdict(list))
+        self.partitions = defaultdict(list)
+        for predicate in PARTITION_PREDICATES:
+            for s, o in graph.subject_objects(predicate):
+                if predicate in (CLASS_PARTITION, PROPERTY_PARTITION):
+                    self.partitions[predicate].append(o)
+                else:
+                    self.values[s][predicate].append(o)
+
+    def first(self, node, predicate, convert):
+        objects = self.values[node].get(predicate)
+        return convert(objects[0]) if objects else None
+
+    def class_partitions(self):
+        return [
+            SBMClassPartition(self.first(node, RDFS_CLASS, self.compact), self.first(node, RDFS_ENTITIES, int))
+            for node in self.partitions[CLASS_PARTITION]
+        ]
+
+    def class_relation(self, node):
+        return SBMClassRelation(
+            self.first(node, RDFS_TRIPLES, int),
+            self.first(node, SUBJECT_CLASS, self.compact),
+            self.first(node, OBJECT_CLASS, self.compact),
+            self.first(node, OBJECT_DATATYPE, self.compact))
+
+    def property_partitions(self):
+        return [
+            SBMPropertyPartition(
+                self.first(node, RDFS_PROPERTY, self.compact),
+                self.first(node, RDFS_TRIPLES, int),
+                unique_class_relations(self.class_relation(r) for r in self.values[node].get(CLASS_RELATION, ())))
+            for node in self.partitions[PROPERTY_PARTITION]
+        ]
+
+
 class AssetReader(object):
     def __init__(self, assets_dir):
         super(AssetReader, self).__init__()
         self.assets_dir = assets_dir
+        self.terms = None
+        self.store = None
+        if assets_dir and is_sqlite_assets(assets_dir):
+            self.store = SQLiteAssets(os.path.join(assets_dir, ASSETS_DB))
+        elif assets_dir and is_binary_assets(assets_dir):
+            self.terms = TermTable(os.path.join(assets_dir, TERMS_FILE))
+
+    # 主語や目的語をキーにして引けるassetかどうか。
+    @property
+    def indexed(self):
+        return self.store is not None
 
-    def read_subject_object(self, filename, graph):
-        if not self.assets_dir:
+    # seedsからsameAsとsubClassOfで辿れる項をN3形式で返す。indexedの場合のみ使える。
+    def related_terms(self, seeds):
+        return self.store.related_terms(seeds)
+
+    # JSON LinesかSQLiteのassetの(主語, 目的語)をN3形式のまま返す。
+    def read_rows(self, filename, subjects=None):
+        if self.store is not None:
+            yield from self.store.rows(filename, subjects)
             return
         try:
             with open(os.path.join(self.assets_dir, filename)) as fp:
                 for row in fp:
-                    row = row.strip()
                     obj = json.loads(row)
-                    so = obj['s'], obj['o']
-                    yield tuple(map(lambda x: URIRef(x[1:-1]).n3(graph.namespace_manager).strip('<>'), so))
+                    if subjects is None or obj['s'] in subjects:
+                        yield obj['s'], obj['o']
         except IOError:
             return
 
-    def read_subject_literal(self, filename, graph):
+    # assetの(主語, 目的語)をそれぞれ変換して返す。
+    # subjectsを指定した場合は主語(N3形式)がその中にある行だけを返す。
+    # subject_converterがNoneを返した行は、目的語を変換せずに読み飛ばす。
+    # バイナリ形式の場合、項の変換は主語と目的語それぞれでIDごとに1回だけ行う。
+    def read_converted(self, filename, subject_converter, object_converter, subjects=None):
         if not self.assets_dir:
             return
-        try:
-            with open(os.path.join(self.assets_dir, filename)) as fp:
-                for row in fp:
-                    obj = json.loads(row)
-                    s, o = obj['s'], obj['o']
-                    yield URIRef(s[1:-1]).n3(graph.namespace_manager).strip('<>'), parse_literal(o)
-        except IOError:
+        if self.terms is None:
+            for s, o in self.read_rows(filename, subjects):
+                subject = subject_converter(s)
+                if subject is not None:
+                    yield subject, object_converter(o)
             return
 
+        subject_cache = {}
+        object_cache = {}
+        for s, o in read_pairs(os.path.join(self.assets_dir, filename + PAIRS_SUFFIX)):
+            if s in subject_cache:
+                subject = subject_cache[s]
+            else:
+                term = self.terms[s]
+                subject = subject_cache[s] = subject_converter(term) if subjects is None or term in subjects else None
+            if subject is None:
+                continue
+            obj = object_cache.get(o)
+            if obj is None:
+                obj = object_cache[o] = object_converter(self.terms[o])
+            yield subject, obj
+
+    def read_subject_object(self, filename, compactor, subjects=None):
+        return self.read_converted(filename, compactor.compact_n3, compactor.compact_n3, subjects)
+
+    # urisを指定した場合はCURIEにした主語がその中にある行だけを返す。
+    def read_subject_literal(self, filename, compactor, subjects=None, uris=None):
+        def subject_converter(term):
+            uri = compactor.compact_n3(term)
+            return uri if uris is None or uri in uris else None
+        return self.read_converted(filename, subject_converter, parse_literal, subjects)
+
     def load_prefix(self, graph: Graph):
         if not self.assets_dir:
             return
@@ -222,118 +299,135 @@ class AssetReader(object):
             pass
 
 
-def extraction_classes(graph):
-    class_partition = URIRef('http://rdfs.org/ns/void#classPartition')
-    classes = []
-    for node in graph.objects(predicate=class_partition):
-        classes.append(SBMClassPartition(graph, node))
-    return classes
+def extraction_classes(extractor):
+    return extractor.class_partitions()
 
 
-def extraction_properties(graph):
-    property_partition = URIRef('http://rdfs.org/ns/void#propertyPartition')
+# 同じURIのプロパティは最初のものだけを残す。
+def extraction_properties(extractor):
     properties = []
-    for node in graph.objects(predicate=property_partition):
-        prop = SBMPropertyPartition(graph, node)
-        if not any(prop.uri == i.uri for i in properties):
+    uris = set()
+    for prop in extractor.property_partitions():
+        if prop.uri not in uris:
+            uris.add(prop.uri)
             properties.append(prop)
     return properties
 
 
-def get_labels(graph, asset_reader):
-    labels = {}
-    for s, o in asset_reader.read_subject_literal('label', graph):
-        if s not in labels:
-            labels[s] = []
-        labels[s].append(o)
-    return {uri: labels_lang(labels[uri]) for uri in labels}
-
-def inheritance_structure(graph, classes, sub_class_map, asset_reader):
-    same_as_group = {}
-    for s, o in asset_reader.read_subject_object('sameAs', graph):
-        group = same_as_group.get(s) or same_as_group.get(o) or set()
-        group.add(s)
-        group.add(o)
-        same_as_group[s] = same_as_group[o] = group
+# SBMに現れるクラス、プロパティ、データ型のURIをN3形式で返す。
+def sbm_terms(graph):
+    terms = set()
+    for predicate in SBM_TERM_PREDICATES:
+        for o in graph.objects(predicate=predicate):
+            if isinstance(o, URIRef):
+                terms.add(o.n3())
+    return terms
+
+
+# モデルに書き出すクラスとプロパティ、それらから参照される項のCURIEを、書き出しながら集める。
+class ModelUris(set):
+    # (URI, クラスの詳細)をそのまま返す。
+    def classes(self, items):
+        for uri, detail in items:
+            self.add(uri)
+            self.update(detail.get('subClassOf', ()))
+            for pair in detail.get('rhs', []) + detail.get('lhs', []):
+                self.update(pair)
+            yield uri, detail
+
+    # プロパティの詳細をそのまま返す。
+    def properties(self, details):
+        for prop in details:
+            self.add(prop['uri'])
+            for relation in prop['class_relations']:
+                self.update((relation['subject_class'], relation['object_class'], relation['object_datatype']))
+            yield prop
+
+
+# ラベルを(CURIE, 言語ごとのラベル)として主語が最初に現れた順に返す。urisを指定した場合はその項のラベルだけを読む。
+# 以前のbuild-indexが作ったassetは主語ごとにまとまっていないので、全ての行を読んでから主語ごとにまとめる。
+# 集めるのはurisに絞ったモデルに現れる項のラベルだけなので、モデルの大きさで抑えられる。
+def iter_labels(compactor, asset_reader, subjects=None, uris=None):
+    literals = defaultdict(list)
+    for s, o in asset_reader.read_subject_literal('label', compactor, subjects, uris):
+        literals[s].append(o)
+    for s, values in literals.items():
+        yield s, labels_lang(values)
+
+
+# クラスの継承構造を作る。内部ではクラスを項のID(terms)で扱い、木に出す時にURIに戻す。
+# structureが'dag'の場合、複数の上位クラスを持つクラスの部分木は1回だけ出し、2回目以降は参照にする。
+def inheritance_structure(compactor, terms, classes, sub_class_map, asset_reader, subjects=None, structure='tree'):
+    intern = terms.intern
+    same_as_groups = EquivalenceGroups()
+    for s, o in asset_reader.read_subject_object('sameAs', compactor, subjects):
+        same_as_groups.union(intern(s), intern(o))
     classes_map = {}
     for c in classes:
-        classes_map[c.uri] = c
-        for c_uri in same_as_group.get(c.uri, ()):
-            classes_map[c_uri] = c
-
-    top_level_uri = set()
-    sub_class_nodes = defaultdict(set)
-
-    def recursive_parent_node(uri):
-        parent_classes = sub_class_map.get(uri)
-
-        if uri in classes_map:
-            value = classes_map[uri].uri
-        else:
-            value = uri
-
-        if not parent_classes:
-            top_level_uri.add(value)
-        else:
-            for parent_class in parent_classes:
-                sub_class_nodes[parent_class].add(value)
-                recursive_parent_node(parent_class)
-
+        c_id = intern(c.uri)
+        classes_map[c_id] = c
+        for member in same_as_groups.members(c_id):
+            classes_map[member] = c
+
+    # sameAsでまとめたクラスは代表のURIで木に出す。
+    # 木の中の位置とsubClassOfは、グループの中で上位クラスを持つ1つの項(representatives)の上位クラスで決める。
+    hierarchy = Hierarchy(
+        sub_class_map, lambda term: intern(classes_map[term].uri) if term in classes_map else term, terms.term)
+    representatives = {}
     for c in classes:
-        for c_uri in same_as_group.get(c.uri, (c.uri, )):
-            if c_uri in sub_class_map:
-                recursive_parent_node(c_uri)
-                break
+        c_id = intern(c.uri)
+        representative = representatives[c_id] = same_as_representative(terms, same_as_groups, sub_class_map, c_id)
+        if representative is None:
+            hierarchy.top_level.add(c_id)
         else:
-            top_level_uri.add(c.uri)
-
-    def recursive_dig_node(uri):
-        node = {
-            'uri': uri,
-        }
-        if uri in sub_class_nodes:
-            node['children'] = [recursive_dig_node(parent) for parent in sub_class_nodes[uri]]
-        return node
-
-    obj = [recursive_dig_node(top) for top in top_level_uri]
-    return obj, classes_map
-
-
-def class_reference(graph, classes, structure, classes_map, sub_class_map, asset_reader):
-    def flat_structure(node):
-        uri = node['uri']
-        if uri not in classes_map:
+            hierarchy.climb(representative)
+    return hierarchy.trees(references=structure == 'dag'), classes_map, representatives
+
+
+# sameAsのグループの中で、上位クラスを使う項を返す。
+# クラス自身が上位クラスを持てばそれを、持たなければ上位クラスを持つ項のうちURIが最小のものを使う。
+# 項のIDはassetを読んだ順に振られるので、IDの順では選ばない。どの項も上位クラスを持たない場合はNoneを返す。
+def same_as_representative(terms, same_as_groups, sub_class_map, class_id):
+    if class_id in sub_class_map:
+        return class_id
+    candidates = [member for member in same_as_groups.members(class_id) if member in sub_class_map]
+    return min(candidates, key=terms.term) if candidates else None
+
+
+# 木に出てくるクラスをclassesに足し、各クラスのsubClassOfを決める。
+# 戻り値はURIごとのクラス。同じURIのクラスが複数ある場合は最後のものを使う。
+# representativesはSBMのクラスごとのsameAsの代表(inheritance_structureを参照)。
+def class_reference(terms, classes, structure, classes_map, sub_class_map, representatives, asset_reader):
+    for uri in iter_tree_uris(structure):
+        uri_id = terms.intern(uri)
+        if uri_id not in classes_map:
             c = ClassResource(uri)
-            classes_map[uri] = c
+            classes_map[uri_id] = c
             classes.append(c)
 
-        for child_node in node.get('children', ()):
-            flat_structure(child_node)
-
-    for top in structure:
-        flat_structure(top)
-
-    for s, o in classes_map.items():
-        if s in sub_class_map:
-            o.subClassOf = sub_class_map[s]
+    for c in classes:
+        c_id = terms.intern(c.uri)
+        parents = sub_class_map.get(representatives.get(c_id, c_id))
+        if parents:
+            c.subClassOf = [terms.term(parent) for parent in parents]
 
-    return {c.uri: c.serialize() for c in classes}
+    return {c.uri: c for c in classes}
 
 
 def make_meta_data(graph):
     meta_data = {}
 
-    for o in graph.objects(predicate=URIRef('http://www.w3.org/ns/sparql-service-description#endpoint')):
+    for o in graph.objects(predicate=ENDPOINT):
         meta_data['endpoint'] = o
         break
 
-    for o in graph.objects(predicate=URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#crawlLog')):
-        for start_time in graph.objects(o, URIRef('http://sparqlbuilder.org/2015/09/rdf-metadata-schema#crawlStartTime')):
+    for o in graph.objects(predicate=CRAWL_LOG):
+        for start_time in graph.objects(o, CRAWL_START_TIME):
             meta_data['crawl_date'] = parse_datetime(start_time).strftime('%Y/%m/%d %H:%M:%S')
             break
 
-    for o in graph.objects(predicate=URIRef('http://www.w3.org/ns/sparql-service-description#defaultDataset')):
-        for triples in graph.objects(o, URIRef('http://rdfs.org/ns/void#triples')):
+    for o in graph.objects(predicate=DEFAULT_DATASET):
+        for triples in graph.objects(o, RDFS_TRIPLES):
             meta_data['triples'] = int(triples)
             break
     return meta_data
@@ -361,6 +455,23 @@ NAME_SPACE = (
 )
 
 
+# SBMを別スレッドで読み込む。読み込み中の例外はerrorに残し、呼び出し元で投げ直す。
+class SBMLoader(threading.Thread):
+    def __init__(self, graph, sbm_ttl, stream, snapshot):
+        super(SBMLoader, self).__init__(daemon=True)
+        self.graph = graph
+        self.sbm_ttl = sbm_ttl
+        self.stream = stream
+        self.snapshot = snapshot
+        self.error = None
+
+    def run(self):
+        try:
+            load_sbm(self.graph, self.sbm_ttl, SBM_PREDICATES, self.stream, self.snapshot)
+        except Exception as e:
+            self.error = e
+
+
 def spinner_gen():
     while 1:
         yield '|'
@@ -369,16 +480,27 @@ def spinner_gen():
         yield '\\'
 
 
-def build_sbm_model(sbm_ttl, assets_dir, dist):
-    graph = Graph()
+# SBMはモデルの作成と検証に使う述語のトリプルだけを残して読み込むので、
+# グラフの大きさはパーティションの数で決まる。
+# streamがTrueの場合はファイル全体を文字列として持たず、少しずつパースする。
+# snapshotがTrueの場合は、SBMの隣に置いたスナップショットが使えればパースを省く。
+# storeを指定した場合はグラフをそのパスのSQLiteに置き、次回以降も同じSBMならそのまま使う。
+# structureは継承構造の出力形式で、'tree'(既定)か'dag'。
+# compact、compress、json_backendはmodel.jsonの書き出し方(ModelWriterを参照)。
+def build_sbm_model(sbm_ttl, assets_dir, dist, stream=False, snapshot=False, store=None, structure='tree',
+                    compact=False, compress=False, json_backend='json'):
+    if store:
+        graph = Graph(store=SQLiteStore(SBM_PREDICATES))
+        graph.open(store, create=True)
+    else:
+        graph = Graph(store=PredicateFilterStore(SBM_PREDICATES))
     asset_reader = AssetReader(assets_dir)
     for prefix, uri in NAME_SPACE:
         graph.namespace_manager.bind(prefix, uri)
     asset_reader.load_prefix(graph)
-    get_labels(graph, asset_reader)
 
     print(i18n_t('cmd.build.info_loading_data'))
-    thread = threading.Thread(target=graph.parse, kwargs=dict(location=sbm_ttl, format='turtle'))
+    thread = SBMLoader(graph, sbm_ttl, stream, snapshot)
     thread.start()
     for spinner in spinner_gen():
         sys.stdout.write(spinner + '\033[1D')
@@ -386,48 +508,67 @@ def build_sbm_model(sbm_ttl, assets_dir, dist):
         time.sleep(0.2)
         if not thread.is_alive():
             break
+    thread.join()
+    if thread.error:
+        graph.close()
+        raise thread.error
     try:
         validate_graph(graph)
     except GraphValidationError as e:
         print(e)
+        graph.close()
         return
     print(i18n_t('cmd.build.info_loaded_data'))
 
     print(i18n_t('cmd.build.info_preparing_classes'))
-    classes = extraction_classes(graph)
-    sub_class_map = defaultdict(list)
-    for s, o in asset_reader.read_subject_object('subClassOf', graph):
-        sub_class_map[s].append(o)
-    structure, classes_map = inheritance_structure(graph, classes, sub_class_map, asset_reader)
+    # CURIEへの変換はSBMとassetのprefixが揃った後に1つ作り、全体で使い回す。
+    compactor = CurieCompactor(graph)
+    extractor = PartitionExtractor(graph, compactor)
+    classes = extraction_classes(extractor)
+    # インデックス付きのassetでは、SBMに現れる項から辿れる行だけを引く。
+    related = asset_reader.related_terms(sbm_terms(graph)) if asset_reader.indexed else None
+    # クラスやプロパティは項のIDにして扱い、書き出す時に文字列に戻す。
+    terms = TermDictionary()
+    intern = terms.intern
+    sub_class_map = defaultdict(lambda: array('q'))
+    for s, o in asset_reader.read_subject_object('subClassOf', compactor, related):
+        sub_class_map[intern(s)].append(intern(o))
+    inheritance, classes_map, representatives = inheritance_structure(
+        compactor, terms, classes, sub_class_map, asset_reader, related, structure)
 
     print(i18n_t('cmd.build.info_preparing_properties'))
-    properties = extraction_properties(graph)
+    properties = extraction_properties(extractor)
     for p in tqdm(properties):
+        p_id = intern(p.uri)
         for relation in p.class_relations:
-            s = relation.subject_class
-            oc = relation.object_class
+            s = intern(relation.subject_class)
+            oc = intern(relation.object_class)
             if s in classes_map:
-                classes_map[s].rhs.add((p.uri, oc))
+                classes_map[s].rhs[pack_pair(p_id, oc)] = None
             if oc in classes_map:
-                classes_map[oc].lhs.add((s, p.uri))
-    classes_detail = class_reference(graph, classes, structure, classes_map, sub_class_map, asset_reader)
+                classes_map[oc].lhs[pack_pair(s, p_id)] = None
+    unique_classes = class_reference(
+        terms, classes, inheritance, classes_map, sub_class_map, representatives, asset_reader)
     properties = sorted(properties, key=lambda x: x.triples, reverse=True)
 
     print(i18n_t('cmd.build.info_getting_metadata'))
     meta_data = make_meta_data(graph)
     meta_data['classes'] = len(classes)
     meta_data['properties'] = len(properties)
-    result = {
-        'inheritance_structure': structure,
-        'classes': classes_detail,
-        'properties': [p.serialize(classes_detail) for p in properties],
-        'prefixes': {p: n for p, n in graph.namespace_manager.namespaces()},
-        'meta_data': meta_data,
-        'labels': get_labels(graph, asset_reader)
-    }
+    prefixes = {p: n for p, n in graph.namespace_manager.namespaces()}
+    graph.close()
+
+    # クラス、プロパティ、ラベルは書き出す時に1つずつ文字列にし、全体の辞書は作らない。
     print(i18n_t('cmd.build.info_writing_data'))
-    with open(dist, 'w') as fp:
-        json.dump(result, fp, indent=2, ensure_ascii=False)
+    uris = ModelUris()
+    with ModelWriter(dist, compact, compress, json_backend) as writer:
+        writer.write_list('inheritance_structure', inheritance)
+        writer.write_items('classes', uris.classes((uri, c.serialize(terms)) for uri, c in unique_classes.items()))
+        writer.write_list('properties', uris.properties(p.serialize(unique_classes) for p in properties))
+        writer.write('prefixes', prefixes)
+        writer.write('meta_data', meta_data)
+        # ラベルはモデルに現れる項の分だけを、主語ごとに読みながら書く。
+        writer.write_items('labels', iter_labels(compactor, asset_reader, related, uris))
     print(i18n_t('cmd.build.info_number_of_classes'), len(classes))
     print(i18n_t('cmd.build.info_number_of_properties'), len(properties))
-    return dist
+    return writer.path
@@ -0,0 +1,78 @@
+# coding:utf-8
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+CACHE_VERSION = 1
+BLOCK_SIZE = 1 << 20
+ENTRY_FILE = 'entry.json'
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+# 入力ファイルごとにワーカーの出力を保存しておくキャッシュ。
+# キーはファイルの内容、そのファイルより前に宣言されたprefix、抽出するプロパティから作るハッシュ。
+# エントリはキーの名前のディレクトリで、プロパティごとの出力ファイルとentry.jsonを持つ。
+class ChunkCache(object):
+    def __init__(self, cache_dir, output_properties):
+        super(ChunkCache, self).__init__()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        properties = sorted((str(p), output) for p, output in output_properties.items())
+        self.salt = json.dumps([CACHE_VERSION, properties]).encode('utf-8')
+
+    def key(self, file_path, prefix):
+        digest = hashlib.sha256(self.salt)
+        digest.update(prefix.encode('utf-8'))
+        digest.update(b'\0')
+        with open(file_path, 'rb') as fp:
+            for block in iter(lambda: fp.read(BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def load(self, key):
+        try:
+            with open(os.path.join(self.cache_dir, key, ENTRY_FILE)) as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+    # キャッシュした出力ファイルをテンポラリディレクトリのプロパティごとのディレクトリに置く。
+    def restore(self, key, entry, temp_dir):
+        for output, names in entry['outputs'].items():
+            for name in names:
+                fd, dst = tempfile.mkstemp(dir=os.path.join(temp_dir, output))
+                os.close(fd)
+                os.remove(dst)
+                link_or_copy(os.path.join(self.cache_dir, key, name), dst)
+
+    # 出力ファイルをキャッシュに保存する。
+    # 書き終えてから名前を変えるので、途中で止まっても壊れたエントリは残らない。
+    def store(self, key, prefixes, ntriples_prefixes, restrictions, outputs):
+        entry_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        entry = {
+            'prefixes': prefixes,
+            'ntriples_prefixes': ntriples_prefixes,
+            'restrictions': sorted(restrictions),
+            'outputs': {}
+        }
+        for output, file_paths in outputs.items():
+            names = entry['outputs'][output] = []
+            for idx, file_path in enumerate(file_paths):
+                name = '{}-{}'.format(output, idx)
+                link_or_copy(file_path, os.path.join(entry_dir, name))
+                names.append(name)
+        with open(os.path.join(entry_dir, ENTRY_FILE), 'w') as fp:
+            json.dump(entry, fp)
+        try:
+            os.rename(entry_dir, os.path.join(self.cache_dir, key))
+        except OSError:
+            shutil.rmtree(entry_dir)
@@ -0,0 +1,117 @@
+# coding:utf-8
+
+import bz2
+import gzip
+import lzma
+import mmap
+import os
+import struct
+import zlib
+
+# 拡張子で判断する圧縮形式と、そのファイルを展開しながら読むための関数。
+COMPRESSIONS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# BGZF(bgzip)はgzipのメンバーを64KB以下のブロックとして連結したもので、
+# 各ブロックのヘッダの拡張フィールド(BC)にブロックの大きさが入っている。
+# ブロックは単独で展開できるので、ワーカーがそれぞれの範囲を並列に展開できる。
+GZIP_MAGIC = b'\x1f\x8b\x08'
+GZIP_FEXTRA = 4
+GZIP_HEADER_SIZE = 12
+BGZF_SUBFIELD = struct.Struct('<2sH')
+BGZF_BLOCK_SIZE = struct.Struct('<H')
+BGZF_ID = b'BC'
+
+
+# 圧縮形式の拡張子を除いたパスと、その拡張子を返す。圧縮されていない場合の拡張子はNone。
+def split_compression(file_path):
+    root, ext = os.path.splitext(file_path)
+    if ext.lower() in COMPRESSIONS:
+        return root, ext.lower()
+    return file_path, None
+
+
+def is_compressed(file_path):
+    return split_compression(file_path)[1] is not None
+
+
+# 圧縮されたファイルは展開しながら読むバイナリのストリームとして開く。
+# fpを渡した場合はそれを元に開く。
+def open_input(file_path, fp=None):
+    source = file_path if fp is None else fp
+    _, ext = split_compression(file_path)
+    if ext is None:
+        return open(file_path, 'rb') if fp is None else fp
+    return COMPRESSIONS[ext](source, 'rb')
+
+
+# gzipのヘッダからBGZFのブロックの大きさを読む。BGZFでなければNoneを返す。
+def _bgzf_block_size(fp):
+    header = fp.read(GZIP_HEADER_SIZE)
+    if len(header) < GZIP_HEADER_SIZE or header[:3] != GZIP_MAGIC or not header[3] & GZIP_FEXTRA:
+        return None
+    extra_size, = BGZF_BLOCK_SIZE.unpack_from(header, 10)
+    extra = fp.read(extra_size)
+    position = 0
+    while position + BGZF_SUBFIELD.size <= len(extra):
+        subfield_id, length = BGZF_SUBFIELD.unpack_from(extra, position)
+        position += BGZF_SUBFIELD.size
+        if subfield_id == BGZF_ID and length == BGZF_BLOCK_SIZE.size:
+            return BGZF_BLOCK_SIZE.unpack_from(extra, position)[0] + 1
+        position += length
+    return None
+
+
+def is_bgzf(file_path):
+    if split_compression(file_path)[1] != '.gz':
+        return False
+    with open(file_path, 'rb') as fp:
+        return _bgzf_block_size(fp) is not None
+
+
+# BGZFのブロックの(開始オフセット, 大きさ)を順に返す。展開はしない。
+def iter_bgzf_blocks(fp):
+    size = os.fstat(fp.fileno()).st_size
+    offset = 0
+    while offset < size:
+        fp.seek(offset)
+        block_size = _bgzf_block_size(fp)
+        if block_size is None:
+            raise ValueError('{} is not a BGZF file.'.format(fp.name))
+        yield offset, block_size
+        offset += block_size
+
+
+def _inflate(mm, offset):
+    mm.seek(offset)
+    block_size = _bgzf_block_size(mm)
+    return zlib.decompress(mm[offset:offset + block_size], 16 + zlib.MAX_WBITS), offset + block_size
+
+
+# BGZFのブロックの範囲[start, end)を展開し、その範囲に属する行を返す。
+# 範囲の境界は行の途中にありうるので、
+# 先頭の範囲以外は最初の改行までを読み飛ばし、末尾は次の改行まで後ろのブロックを読み進める。
+# 隣り合う範囲は同じ改行を境にするので、どの行もちょうど1つの範囲に属する。
+def read_bgzf_lines(file_path, start, end):
+    with open(file_path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            blocks = []
+            offset = start
+            while offset < end:
+                block, offset = _inflate(mm, offset)
+                blocks.append(block)
+            data = b''.join(blocks)
+            if start > 0:
+                idx = data.find(b'\n')
+                if idx < 0:
+                    return b''
+                data = data[idx + 1:]
+            tail = []
+            while offset < size:
+                block, offset = _inflate(mm, offset)
+                idx = block.find(b'\n')
+                if idx >= 0:
+                    tail.append(block[:idx + 1])
+                    break
+                tail.append(block)
+            return data + b''.join(tail)
@@ -1,15 +1,17 @@
 # coding:utf-8
 
 from rdflib.graph import Graph
-from .utils import get_type
+from .utils import get_type, parse_input
+from .compression import split_compression
 from os.path import splitext
 
 
+# 圧縮されたファイルは圧縮形式の拡張子を除いた名前で書き出す。
 def convert2ttl(owl_files):
     for owl_file in owl_files:
         graph = Graph()
-        graph.parse(location=owl_file, format=get_type(owl_file))
-        ttl_file = splitext(owl_file)[0] + '.ttl'
+        parse_input(graph, owl_file, get_type(owl_file))
+        ttl_file = splitext(split_compression(owl_file)[0])[0] + '.ttl'
         with open(ttl_file, 'wb') as fp:
             hoge = graph.serialize(format='turtle')
             fuga = hoge.encode() if isinstance(hoge, str) else hoge
@@ -0,0 +1,49 @@
+# coding:utf-8
+
+from functools import lru_cache
+from rdflib.namespace import split_uri
+from rdflib.term import URIRef
+
+COMPACT_CACHE_SIZE = 1 << 18
+
+
+# グラフのprefixでURIをCURIEにする。
+# URIRef.n3(namespace_manager)と同じ結果を返すが、名前空間の管理オブジェクトを経由せず、
+# 作成時点のprefixの対応表とURIごとの結果のキャッシュ(上限付き)だけで変換する。
+# rdflibと同じく、URIを名前空間と名前に分けてその名前空間にprefixがある場合だけCURIEにし、
+# さらに長いprefix付きの名前空間がURIに一致すればその中で最も長いものを使う。
+class CurieCompactor(object):
+    def __init__(self, graph):
+        super(CurieCompactor, self).__init__()
+        self.namespace_manager = graph.namespace_manager
+        self.prefixes = {str(namespace): prefix for prefix, namespace in graph.namespaces()}
+        # 名前空間ごとに、それで始まるより長い名前空間を長い順に持つ。
+        self.longer = {}
+        for namespace in self.prefixes:
+            longer = [n for n in self.prefixes if len(n) > len(namespace) and n.startswith(namespace)]
+            if longer:
+                self.longer[namespace] = sorted(longer, key=len, reverse=True)
+        self.compact_uri = lru_cache(maxsize=COMPACT_CACHE_SIZE)(self._compact_uri)
+
+    def _compact_uri(self, uri):
+        try:
+            namespace, _ = split_uri(uri)
+        except ValueError:
+            return uri
+        if namespace not in self.prefixes:
+            return uri
+        for candidate in self.longer.get(namespace, ()):
+            if uri.startswith(candidate):
+                namespace = candidate
+                break
+        return '{}:{}'.format(self.prefixes[namespace], uri[len(namespace):])
+
+    # 項をCURIEにする。URI以外の項はN3形式から<>を除いたもの。
+    def compact(self, term):
+        if isinstance(term, URIRef):
+            return self.compact_uri(str(term))
+        return term.n3(self.namespace_manager).strip('<>')
+
+    # assetのN3形式のURI(<...>)をCURIEにする。
+    def compact_n3(self, term):
+        return self.compact_uri(term[1:-1])
@@ -0,0 +1,52 @@
+# coding:utf-8
+
+from array import array
+
+
+# sameAsなどで同一とされる項のグループ(素集合)。
+# 項は0から始まる連番の整数ID(TermDictionaryのIDなど)で扱い、親のIDとグループの大きさを配列で持つ。
+# 併合は小さいグループを大きいグループの下に付け、代表を探す時は経路を縮めるので、
+# リンクの数に対してほぼ線形の時間とメモリで済む。
+class EquivalenceGroups(object):
+    def __init__(self):
+        super(EquivalenceGroups, self).__init__()
+        self.parents = array('q')
+        self.sizes = array('q')
+        self.groups = None
+
+    def _grow(self, term_id):
+        while len(self.parents) <= term_id:
+            self.parents.append(len(self.parents))
+            self.sizes.append(1)
+
+    def _find(self, term_id):
+        parents = self.parents
+        while parents[term_id] != term_id:
+            parents[term_id] = parents[parents[term_id]]
+            term_id = parents[term_id]
+        return term_id
+
+    def union(self, a, b):
+        self._grow(max(a, b))
+        root_a = self._find(a)
+        root_b = self._find(b)
+        if root_a == root_b:
+            return
+        if self.sizes[root_a] < self.sizes[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parents[root_b] = root_a
+        self.sizes[root_a] += self.sizes[root_b]
+        self.groups = None
+
+    # term_idと同じグループの項のIDを小さい順のタプルで返す。他の項と結ばれていない場合はdefaultを返す。
+    def members(self, term_id, default=()):
+        if term_id >= len(self.parents) or self.sizes[self._find(term_id)] == 1:
+            return default
+        if self.groups is None:
+            groups = {}
+            for member_id in range(len(self.parents)):
+                root = self._find(member_id)
+                if self.sizes[root] > 1:
+                    groups.setdefault(root, []).append(member_id)
+            self.groups = {root: tuple(members) for root, members in groups.items()}
+        return self.groups[self._find(term_id)]
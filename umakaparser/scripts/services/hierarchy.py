@@ -0,0 +1,193 @@
+# coding:utf-8
+
+from collections import defaultdict
+
+ACTIVE = 1
+DONE = 2
+
+
+# subClassOfの階層。
+# parents_mapはURIから上位クラスのURIのリスト、canonicalはURIを木に出すURI(sameAsの代表)に変換する関数。
+# URIの代わりに項のIDを使う場合は、nameに木に出す時にIDをURIに戻す関数を渡す。
+# 上位方向へは各ノードを1回だけ辿り、木は同じノードの部分木を1回だけ作って使い回す。
+# どちらも再帰を使わないので、深い階層でも再帰の上限に当たらない。
+# 木を作る時は最上位のノードと下位ノードをnameの順に辿るので、IDの振り方に依らず同じ木になる。
+class Hierarchy(object):
+    def __init__(self, parents_map, canonical, name=None):
+        super(Hierarchy, self).__init__()
+        self.parents_map = parents_map
+        self.canonical = canonical
+        self.name = name or (lambda uri: uri)
+        self.children = defaultdict(set)
+        self.top_level = set()
+        self.visited = set()
+
+    def _link(self, uri):
+        parents = self.parents_map.get(uri)
+        value = self.canonical(uri)
+        if not parents:
+            self.top_level.add(value)
+            return
+        # 上位クラスも木に出す時のURIで下位ノードを持つ。sameAsでまとめたクラスの下位ノードが失われないようにする。
+        for parent in parents:
+            self.children[self.canonical(parent)].add(value)
+            yield parent
+
+    # uriから上位クラスへ辿り、上位クラスごとの下位ノードと最上位のノードを記録する。
+    # 辿ったノードは覚えておき、別の経路で再び出てきても辿らないので、循環していても止まる。
+    def climb(self, uri):
+        if uri in self.visited:
+            return
+        self.visited.add(uri)
+        stack = [self._link(uri)]
+        while stack:
+            for parent in stack[-1]:
+                if parent not in self.visited:
+                    self.visited.add(parent)
+                    stack.append(self._link(parent))
+                    break
+            else:
+                stack.pop()
+
+    def _ordered(self, nodes):
+        return sorted(nodes, key=self.name)
+
+    # 最上位のノードから深さ優先で辿り、祖先に戻る辺(循環)を除いた下位ノードのリストを返す。
+    def _acyclic_children(self, top_level):
+        children = {}
+        state = {}
+        for top in top_level:
+            if top in state:
+                continue
+            state[top] = ACTIVE
+            children[top] = []
+            stack = [(top, iter(self._ordered(self.children.get(top, ()))))]
+            while stack:
+                uri, iterator = stack[-1]
+                for child in iterator:
+                    if state.get(child) == ACTIVE:
+                        continue
+                    children[uri].append(child)
+                    if child not in state:
+                        state[child] = ACTIVE
+                        children[child] = []
+                        stack.append((child, iter(self._ordered(self.children.get(child, ())))))
+                        break
+                else:
+                    state[uri] = DONE
+                    stack.pop()
+        return children
+
+    # 最上位のノードから辿れないノードは、subClassOfの循環の上か、その下にしかない。
+    # 辿れないノードの中の循環(強連結成分)のうち、他の辿れないノードから入られないものごとに、
+    # nameが最小のノードを返す。これらを最上位に加えると、辿れないノードがなくなる。
+    def _cycle_roots(self, unreached):
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        component_of = {}
+        components = []
+        for root in self._ordered(unreached):
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self._ordered(self.children.get(root, ()))))]
+            while work:
+                uri, iterator = work[-1]
+                for child in iterator:
+                    if child not in unreached:
+                        continue
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self._ordered(self.children.get(child, ())))))
+                        break
+                    if child in on_stack:
+                        low[uri] = min(low[uri], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[uri])
+                    if low[uri] == index[uri]:
+                        component = []
+                        while True:
+                            node = stack.pop()
+                            on_stack.discard(node)
+                            component_of[node] = len(components)
+                            component.append(node)
+                            if node == uri:
+                                break
+                        components.append(component)
+        entered = set(
+            component_of[child] for uri in unreached for child in self.children.get(uri, ())
+            if child in component_of and component_of[child] != component_of[uri])
+        return [min(component, key=self.name) for idx, component in enumerate(components) if idx not in entered]
+
+    # 最上位のノードごとに{'uri': ..., 'children': [...]}の木を返す。
+    # 循環の上にしかないクラスは、循環ごとにnameが最小のノードを最上位として出す。
+    # 複数の上位クラスを持つノードの部分木は同じオブジェクトを共有する。
+    # referencesがTrueの場合は、各ノードの部分木を行きがけ順で最初に現れた所にだけ出し、
+    # 2回目以降は{'uri': ..., 'ref': True}にする。
+    def trees(self, references=False):
+        top_level = self._ordered(self.top_level)
+        children = self._acyclic_children(top_level)
+        nodes = set(self.children).union(*self.children.values())
+        unreached = nodes.difference(children)
+        if unreached:
+            top_level = self._ordered(self.top_level.union(self._cycle_roots(unreached)))
+            children = self._acyclic_children(top_level)
+        if references:
+            return self._reference_trees(top_level, children)
+        built = {}
+        for top in top_level:
+            stack = [top]
+            while stack:
+                uri = stack[-1]
+                if uri in built:
+                    stack.pop()
+                    continue
+                pending = [child for child in children[uri] if child not in built]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                node = {'uri': self.name(uri)}
+                if children[uri]:
+                    node['children'] = [built[child] for child in children[uri]]
+                built[uri] = node
+                stack.pop()
+        return [built[top] for top in top_level]
+
+    def _reference_trees(self, top_level, children):
+        emitted = set()
+        roots = []
+        stack = [(top, roots) for top in reversed(top_level)]
+        while stack:
+            uri, siblings = stack.pop()
+            if uri in emitted:
+                siblings.append({'uri': self.name(uri), 'ref': True})
+                continue
+            emitted.add(uri)
+            node = {'uri': self.name(uri)}
+            siblings.append(node)
+            if children[uri]:
+                node['children'] = []
+                stack.extend((child, node['children']) for child in reversed(children[uri]))
+        return roots
+
+
+# 木のノードのURIを、深さ優先の行きがけ順で最初に現れた順に1回ずつ返す。
+def iter_tree_uris(structure):
+    seen = set()
+    stack = list(reversed(structure))
+    while stack:
+        node = stack.pop()
+        if node['uri'] in seen:
+            continue
+        seen.add(node['uri'])
+        yield node['uri']
+        stack.extend(reversed(node.get('children', ())))
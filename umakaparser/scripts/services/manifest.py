@@ -0,0 +1,93 @@
+# coding:utf-8
+
+import json
+import os
+import threading
+
+MANIFEST_FILE = 'manifest.jsonl'
+
+
+class ManifestMismatchError(Exception):
+    pass
+
+
+# JSONのリストになったチャンクをタプルに戻す。
+def as_chunk(value):
+    return tuple(as_chunk(v) if isinstance(v, list) else v for v in value)
+
+
+# 入力ファイルと設定を表す。再開時に前回と同じかどうかの確認に使う。
+def describe_inputs(owl_file_paths, output_properties, maximum_lines_per_file, shards):
+    inputs = []
+    for file_path in owl_file_paths:
+        stat = os.stat(file_path)
+        inputs.append([file_path, stat.st_size, stat.st_mtime_ns])
+    return {
+        'inputs': inputs,
+        'properties': sorted([str(p), output] for p, output in output_properties.items()),
+        'maximum_lines_per_file': maximum_lines_per_file,
+        'shards': shards,
+    }
+
+
+# build-indexの進み具合を追記していくファイル。
+# 1行が1つのイベントで、start(設定)、split(分割したチャンク)、done(処理したチャンクと結果)、split_done がある。
+# 追記するたびにディスクに書き出すので、プロセスが止まってもそこまでの記録は残る。
+class Manifest(object):
+    def __init__(self, work_dir):
+        super(Manifest, self).__init__()
+        self.path = os.path.join(work_dir, MANIFEST_FILE)
+        self.lock = threading.Lock()
+        self.fp = None
+        self.split_chunks = set()
+        self.done = {}
+
+    # 前回の記録を読み込む。設定が異なる場合はManifestMismatchErrorを投げる。
+    def load(self, description):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as fp:
+            for row in fp:
+                try:
+                    event = json.loads(row)
+                except ValueError:
+                    # 書き込み途中で止まった最後の行は無視する。
+                    break
+                if event['event'] == 'start' and event['description'] != description:
+                    raise ManifestMismatchError(self.path)
+                elif event['event'] == 'split':
+                    self.split_chunks.add(as_chunk(event['chunk']))
+                elif event['event'] == 'done':
+                    result = event['result']
+                    result['chunk'] = as_chunk(result['chunk'])
+                    result['restrictions'] = set(result['restrictions'])
+                    self.done[result['chunk']] = result
+
+    # 処理済みのチャンクが書き出したファイルを返す。
+    def done_files(self):
+        return set(f for result in self.done.values() for f in result['outputs'].values())
+
+    def open(self, description):
+        self.fp = open(self.path, 'a')
+        if not self.split_chunks and not self.done:
+            self.write(event='start', description=description)
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+
+    def write(self, **event):
+        with self.lock:
+            self.fp.write(json.dumps(event) + '\n')
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+
+    def record_split(self, chunk):
+        if chunk not in self.split_chunks:
+            self.split_chunks.add(chunk)
+            self.write(event='split', chunk=chunk)
+
+    def record_done(self, result):
+        self.done[result['chunk']] = result
+        self.write(event='done', result=dict(result, restrictions=sorted(result['restrictions'])))
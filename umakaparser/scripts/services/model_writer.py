@@ -0,0 +1,127 @@
+# coding:utf-8
+
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+INDENT = '  '
+GZIP_SUFFIX = '.gz'
+GZIP_LEVEL = 6
+JSON_BACKENDS = ('json', 'orjson')
+
+
+def has_orjson():
+    return orjson is not None
+
+
+def _dumps_json(value, compact):
+    if compact:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(value, indent=len(INDENT), ensure_ascii=False)
+
+
+def _dumps_orjson(value, compact):
+    option = orjson.OPT_NON_STR_KEYS
+    if not compact:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(value, option=option).decode('utf-8')
+
+
+# model.jsonを項目ごとに書き出す。
+# 既定ではjson.dump(result, fp, indent=2, ensure_ascii=False)と同じ内容になる。
+# compactの場合は空白と改行を入れず、compressの場合はgzipで圧縮して拡張子に.gzを付ける。
+# backendに'orjson'を指定した場合はorjsonで値を文字列にする(インストールされている必要がある)。
+# 書き込み中は一時ファイルに書き、閉じた時に置き換える。
+class ModelWriter(object):
+    def __init__(self, path, compact=False, compress=False, backend='json'):
+        super(ModelWriter, self).__init__()
+        if compress and not path.endswith(GZIP_SUFFIX):
+            path += GZIP_SUFFIX
+        self.path = path
+        self.temp_path = path + '.tmp'
+        self.compact = compact
+        self.dumps = _dumps_orjson if backend == 'orjson' else _dumps_json
+        if compress:
+            self.fp = gzip.open(self.temp_path, 'wt', encoding='utf-8', compresslevel=GZIP_LEVEL)
+        else:
+            self.fp = open(self.temp_path, 'w')
+        self.fp.write('{')
+        self.empty = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+            os.remove(self.temp_path)
+
+    def close(self):
+        self.fp.write('}' if self.empty or self.compact else '\n}')
+        self.fp.close()
+        os.replace(self.temp_path, self.path)
+
+    # levelの深さに置く値を文字列にする。
+    def _encode(self, value, level):
+        text = self.dumps(value, self.compact)
+        if self.compact:
+            return text
+        return text.replace('\n', '\n' + INDENT * level)
+
+    # 親のコンテナ内で、levelの深さに次の要素を置くための区切りを書く。
+    def _next(self, first, level):
+        if not first:
+            self.fp.write(',')
+        if not self.compact:
+            self.fp.write('\n' + INDENT * level)
+
+    # キーはjsonと同じく、文字列以外(Noneや数値)はJSONでの表記を文字列にしたものにする。
+    def _key(self, key):
+        if not isinstance(key, str):
+            key = json.dumps(key)
+        self.fp.write(json.dumps(key, ensure_ascii=False) + (':' if self.compact else ': '))
+
+    def _section(self, key):
+        self._next(self.empty, 1)
+        self.empty = False
+        self._key(key)
+
+    def _close_container(self, closing, empty):
+        if not empty and not self.compact:
+            self.fp.write('\n' + INDENT)
+        self.fp.write(closing)
+
+    # 値を1つの項目として書く。
+    def write(self, key, value):
+        self._section(key)
+        self.fp.write(self._encode(value, 1))
+
+    # (キー, 値)を順に受け取り、オブジェクトの項目として1つずつ書く。
+    def write_items(self, key, items):
+        self._section(key)
+        self.fp.write('{')
+        first = True
+        for item_key, value in items:
+            self._next(first, 2)
+            first = False
+            self._key(item_key)
+            self.fp.write(self._encode(value, 2))
+        self._close_container('}', first)
+
+    # 値を順に受け取り、配列の要素として1つずつ書く。
+    def write_list(self, key, values):
+        self._section(key)
+        self.fp.write('[')
+        first = True
+        for value in values:
+            self._next(first, 2)
+            first = False
+            self.fp.write(self._encode(value, 2))
+        self._close_container(']', first)
@@ -0,0 +1,63 @@
+# coding:utf-8
+
+import json
+import os
+import tempfile
+from collections import defaultdict
+from rdflib.graph import Graph
+from .build import sbm_terms, SBM_TERM_PREDICATES
+from .utils import PredicateFilterStore, parse_input
+
+SAME_AS = 'sameAs'
+SUB_CLASS_OF = 'subClassOf'
+
+
+# SBMのファイルからクラス、プロパティ、データ型のURIをN3形式で返す。
+# 必要な述語のトリプルだけを残してパースする。
+def sbm_seeds(sbm_ttl):
+    graph = Graph(store=PredicateFilterStore(SBM_TERM_PREDICATES))
+    parse_input(graph, sbm_ttl, 'turtle')
+    return sbm_terms(graph)
+
+
+def _read_pairs(base_dir, name):
+    path = os.path.join(base_dir, name)
+    if not os.path.exists(path):
+        return
+    with open(path) as fp:
+        for row in fp:
+            obj = json.loads(row)
+            yield obj['s'], obj['o']
+
+
+# マージ済みのassetで、seedsからsameAs(両方向)とsubClassOf(上位方向)で辿れる項を全て返す。
+def related_terms(base_dir, seeds):
+    links = defaultdict(set)
+    for s, o in _read_pairs(base_dir, SAME_AS):
+        links[s].add(o)
+        links[o].add(s)
+    for s, o in _read_pairs(base_dir, SUB_CLASS_OF):
+        links[s].add(o)
+    related = set(seeds)
+    frontier = list(related)
+    while frontier:
+        term = frontier.pop()
+        for linked in links.get(term, ()):
+            if linked not in related:
+                related.add(linked)
+                frontier.append(linked)
+    return related
+
+
+# マージ済みのassetから主語がtermsに含まれる行だけを残す。
+def prune_assets(base_dir, output_names, terms):
+    for name in output_names:
+        path = os.path.join(base_dir, name)
+        if not os.path.exists(path):
+            continue
+        fd, temp_file = tempfile.mkstemp(dir=base_dir)
+        with os.fdopen(fd, 'w') as output_fp, open(path) as fp:
+            for row in fp:
+                if json.loads(row)['s'] in terms:
+                    output_fp.write(row)
+        os.replace(temp_file, path)
@@ -0,0 +1,69 @@
+# coding:utf-8
+
+import threading
+from collections import deque
+
+MIN_CHUNK_BYTES = 1 << 20
+RATIO_WINDOW = 16
+
+
+# チャンクの入力のバイト数。シャードの場合は各範囲の合計。
+def chunk_size_of(chunk):
+    ranges = chunk if isinstance(chunk[0], tuple) else (chunk, )
+    return sum(end - start for _, start, end in ranges)
+
+
+# ワーカーに渡すチャンクの数と大きさを決める。
+# ワーカーはチャンクの処理中に増えたメモリを返し、そこから入力1バイトあたりのメモリを見積もる。
+# max_memoryを指定した場合は、処理中のチャンクの見積もりの合計が上限を超えないように渡し、
+# 1ワーカーあたりの上限に収まるようにチャンクのバイト数を小さくする。
+# 見積もりができるまでは1つずつ処理する。
+# max_memoryを指定しない場合は処理中のチャンクをworkers*2個までに抑えるだけ。
+class MemoryScheduler(object):
+    def __init__(self, workers, max_memory=None):
+        super(MemoryScheduler, self).__init__()
+        self.workers = workers
+        self.max_memory = max_memory
+        self.limit = workers if max_memory else workers * 2
+        self.condition = threading.Condition()
+        self.in_flight = {}
+        self.ratios = deque(maxlen=RATIO_WINDOW)
+
+    # 直近のチャンクで観測した入力1バイトあたりのメモリの最大値。
+    @property
+    def ratio(self):
+        return max(self.ratios) if self.ratios else None
+
+    # 1ワーカーあたりの上限に収まるチャンクのバイト数。上限がないか見積もれない場合はNone。
+    @property
+    def chunk_bytes(self):
+        ratio = self.ratio
+        if not self.max_memory or ratio is None:
+            return None
+        return max(int(self.max_memory / self.workers / ratio), MIN_CHUNK_BYTES)
+
+    def _admissible(self, chunk):
+        if len(self.in_flight) >= self.limit:
+            return False
+        if not self.max_memory or not self.in_flight:
+            return True
+        if self.ratio is None:
+            return False
+        return sum(self.in_flight.values()) + chunk_size_of(chunk) * self.ratio <= self.max_memory
+
+    # chunkを処理に回せるまで待つ。timeoutまでに回せなければFalseを返す。
+    def acquire(self, chunk, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self._admissible(chunk), timeout):
+                return False
+            self.in_flight[chunk] = chunk_size_of(chunk) * (self.ratio or 0)
+            return True
+
+    # ワーカーの処理結果を受け取り、見積もりを更新する。
+    def release(self, result):
+        with self.condition:
+            self.in_flight.pop(result['chunk'], None)
+            size = chunk_size_of(result['chunk'])
+            if result.get('memory') is not None and size:
+                self.ratios.append(max(result['memory'], 1) / size)
+            self.condition.notify_all()
@@ -0,0 +1,151 @@
+# coding:utf-8
+
+import hashlib
+import json
+import os
+import tempfile
+import rdflib
+from rdflib.graph import Graph
+from rdflib.term import URIRef
+from .sqlite_store import SQLiteStore
+from .streaming import stream_turtle
+from .utils import PredicateFilterStore, decode_term, encode_term, parse_input
+
+# パースの結果の形が変わった場合は上げる。rdflibのバージョンと合わせてスナップショットのキーに含める。
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FORMAT = 'umakaparser-snapshot'
+SNAPSHOT_SUFFIX = '.umakaparser-snapshot'
+HASH_BUFFER_SIZE = 1 << 20
+
+
+# 対象の述語のトリプルをパースされた順にリストに溜めるストア。
+# グラフに入れる順番で抽出結果の順番が決まるので、索引ではなく順番を保ったリストとして持つ。
+class RecordingStore(PredicateFilterStore):
+    def __init__(self, predicates, configuration=None, identifier=None):
+        super(RecordingStore, self).__init__(predicates, configuration, identifier)
+        self.triples = []
+
+    def add(self, triple, context, quoted=False):
+        if triple[1] in self.predicates:
+            self.triples.append(triple)
+
+
+# パーサーがgraph.bindで登録したprefix宣言を登録した順に記録するグラフ。
+# グラフが既定で登録するprefixはrdflibのバージョンで異なるので、SBMで宣言されたものだけを取り出すのに使う。
+class RecordingGraph(Graph):
+    def __init__(self, store):
+        super(RecordingGraph, self).__init__(store=store)
+        self.bindings = []
+
+    def bind(self, prefix, namespace, *args, **kwargs):
+        self.bindings.append((prefix, URIRef(namespace)))
+        return super(RecordingGraph, self).bind(prefix, namespace, *args, **kwargs)
+
+
+def snapshot_path(file_path):
+    return file_path + SNAPSHOT_SUFFIX
+
+
+# ファイルの中身、パーサーのバージョン、残す述語からスナップショットのキーを作る。
+def snapshot_key(file_path, predicates):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(HASH_BUFFER_SIZE), b''):
+            digest.update(block)
+    digest.update('\n{}\n{}\n'.format(SNAPSHOT_VERSION, rdflib.__version__).encode('utf-8'))
+    for predicate in sorted(predicates):
+        digest.update(predicate.encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+
+# スナップショットはJSON Linesのテキストで、コードを実行する形式(pickleなど)は使わない。
+# 1行目はキー、prefix宣言、トリプルの数を持つヘッダーで、2行目以降は1行に1つのトリプルの項をencode_termの形で持つ。
+# キーが一致するスナップショットを読み込む。無いか、壊れているか、古い場合はNoneを返す。
+def read_snapshot(path, key):
+    try:
+        with open(path, encoding='utf-8') as fp:
+            header = json.loads(fp.readline())
+            if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT or header.get('key') != key:
+                return None
+            namespaces = [(prefix, URIRef(namespace)) for prefix, namespace in header['namespaces']]
+            triples = [tuple(decode_term(*term) for term in json.loads(row)) for row in fp]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if len(triples) != header.get('triples') or any(len(triple) != 3 for triple in triples):
+        return None
+    return {'key': key, 'namespaces': namespaces, 'triples': triples}
+
+
+# スナップショットを書き出す。入力のディレクトリに書き込めない場合は何もしない。
+def write_snapshot(path, snapshot):
+    try:
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return
+    header = {
+        'format': SNAPSHOT_FORMAT,
+        'key': snapshot['key'],
+        'namespaces': [[prefix, str(namespace)] for prefix, namespace in snapshot['namespaces']],
+        'triples': len(snapshot['triples']),
+    }
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            fp.write(json.dumps(header, ensure_ascii=False) + '\n')
+            for triple in snapshot['triples']:
+                fp.write(json.dumps([encode_term(term) for term in triple], ensure_ascii=False) + '\n')
+        os.replace(temp_file, path)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def _parse(graph, file_path, stream):
+    if stream:
+        stream_turtle(graph, file_path)
+    else:
+        parse_input(graph, file_path, 'turtle')
+
+
+# ディスク上のストアにSBMを読み込む。ストアが同じ中身のファイルから作られていればパースしない。
+# ストアには前回読み込んだファイルのキーとprefix宣言も保存する。
+def _load_store(graph, file_path, predicates, stream):
+    store = graph.store
+    key = snapshot_key(file_path, predicates)
+    namespaces = store.source_namespaces(key)
+    if namespaces is None:
+        store.clear()
+        parsed = RecordingGraph(store.share())
+        _parse(parsed, file_path, stream)
+        namespaces = parsed.bindings
+        store.set_source(key, namespaces)
+        store.commit()
+    for prefix, namespace in namespaces:
+        graph.bind(prefix, namespace)
+
+
+# SBMのpredicatesのトリプルとprefix宣言をgraphに読み込む。
+# use_snapshotがTrueの場合は、入力の隣に置いたスナップショットが同じ中身から作られていればパースせずにそれを使い、
+# そうでなければパースした結果をスナップショットとして書き出す。
+# prefix宣言はSBMで宣言された順にgraphに登録するので、パースした場合と同じ結果になる。
+# graphがSQLiteStoreを使う場合はストアそのものを再利用するので、スナップショットは使わない。
+def load_sbm(graph, file_path, predicates, stream=False, use_snapshot=False):
+    if isinstance(graph.store, SQLiteStore):
+        _load_store(graph, file_path, predicates, stream)
+        return
+    snapshot = None
+    if use_snapshot:
+        key = snapshot_key(file_path, predicates)
+        snapshot = read_snapshot(snapshot_path(file_path), key)
+    if snapshot is None:
+        parsed = RecordingGraph(RecordingStore(predicates))
+        _parse(parsed, file_path, stream)
+        snapshot = {
+            'namespaces': parsed.bindings,
+            'triples': parsed.store.triples,
+        }
+        if use_snapshot:
+            snapshot['key'] = key
+            write_snapshot(snapshot_path(file_path), snapshot)
+    for prefix, namespace in snapshot['namespaces']:
+        graph.bind(prefix, namespace)
+    graph.addN((s, p, o, graph) for s, p, o in snapshot['triples'])
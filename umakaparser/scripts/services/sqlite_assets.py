@@ -0,0 +1,88 @@
+# coding:utf-8
+
+import json
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+# SQLite形式のasset
+# 全プロパティの(主語, 目的語)をN3形式で1つのテーブルに入れ、
+# 主語と目的語それぞれにインデックスを張る。
+ASSETS_DB = 'assets.sqlite'
+BATCH_SIZE = 500
+SAME_AS = 'sameAs'
+SUB_CLASS_OF = 'subClassOf'
+
+
+# JSON Linesのassetを1つのSQLiteファイルに変換する。
+# 変換後は元のファイルを削除する。
+def convert_to_sqlite(base_dir, output_names):
+    db_path = os.path.join(base_dir, ASSETS_DB)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    connection = sqlite3.connect(db_path)
+    try:
+        with connection:
+            connection.execute('CREATE TABLE assets (property TEXT NOT NULL, s TEXT NOT NULL, o TEXT NOT NULL)')
+            for name in output_names:
+                path = os.path.join(base_dir, name)
+                if not os.path.exists(path):
+                    continue
+                with open(path) as fp:
+                    rows = ((name, obj['s'], obj['o']) for obj in map(json.loads, fp))
+                    connection.executemany('INSERT INTO assets VALUES (?, ?, ?)', rows)
+                os.remove(path)
+            connection.execute('CREATE INDEX assets_subject ON assets (property, s)')
+            connection.execute('CREATE INDEX assets_object ON assets (property, o)')
+    finally:
+        connection.close()
+
+
+def is_sqlite_assets(assets_dir):
+    return os.path.exists(os.path.join(assets_dir, ASSETS_DB))
+
+
+def _batches(terms):
+    terms = list(terms)
+    for idx in range(0, len(terms), BATCH_SIZE):
+        yield terms[idx:idx + BATCH_SIZE]
+
+
+class SQLiteAssets(object):
+    def __init__(self, path):
+        super(SQLiteAssets, self).__init__()
+        self.connection = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(path))), uri=True)
+
+    def close(self):
+        self.connection.close()
+
+    # columnの値がtermsに含まれる行をインデックスを使って引く。
+    # 行はcolumnの値ごとにまとめ、その中は変換前のassetと同じ順番で返す。
+    def _lookup(self, name, column, terms):
+        for batch in _batches(terms):
+            query = 'SELECT s, o FROM assets WHERE property = ? AND {0} IN ({1}) ORDER BY {0}, rowid'.format(
+                column, ', '.join('?' * len(batch)))
+            for row in self.connection.execute(query, [name] + batch):
+                yield row
+
+    # subjectsを指定した場合は主語がその中にある行だけを返す。
+    def rows(self, name, subjects=None):
+        if subjects is None:
+            return self.connection.execute('SELECT s, o FROM assets WHERE property = ? ORDER BY rowid', (name, ))
+        return self._lookup(name, 's', subjects)
+
+    # seedsからsameAs(両方向)とsubClassOf(上位方向)で辿れる項を全て返す。
+    def related_terms(self, seeds):
+        related = set(seeds)
+        frontier = set(seeds)
+        while frontier:
+            found = set()
+            for s, o in self._lookup(SAME_AS, 's', frontier):
+                found.add(o)
+            for s, o in self._lookup(SAME_AS, 'o', frontier):
+                found.add(s)
+            for s, o in self._lookup(SUB_CLASS_OF, 's', frontier):
+                found.add(o)
+            frontier = found - related
+            related.update(frontier)
+        return related
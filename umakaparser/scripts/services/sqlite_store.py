@@ -0,0 +1,174 @@
+# coding:utf-8
+
+import json
+import os
+import sqlite3
+from functools import lru_cache
+from rdflib.plugins.stores.memory import Memory
+from rdflib.store import Store, VALID_STORE, NO_STORE
+from rdflib.term import URIRef
+from .utils import decode_term, encode_term
+
+# SBMのグラフをディスクに置くためのSQLiteのストア。
+# 項は種類・値・データ型・言語で1行のテーブルに入れて整数IDを振り、トリプルはIDの組で持つ。
+# SQLiteのページキャッシュとIDと項の変換のキャッシュだけをメモリに置く。
+CACHE_SIZE_KIB = 1 << 16
+TERM_CACHE_SIZE = 1 << 16
+SOURCE_KEY = 'source_key'
+SOURCE_NAMESPACES = 'source_namespaces'
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, '
+    'datatype TEXT NOT NULL, language TEXT NOT NULL, UNIQUE (kind, value, datatype, language))',
+    'CREATE TABLE IF NOT EXISTS triples (s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL, '
+    'UNIQUE (s, p, o))',
+    'CREATE INDEX IF NOT EXISTS triples_pos ON triples (p, o, s)',
+    'CREATE INDEX IF NOT EXISTS triples_osp ON triples (o, s, p)',
+    'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)',
+)
+
+# 指定された項の組み合わせごとに、絞り込む列と並べる単位。
+# rdflibのMemoryストアと同じ順番で返すように、並べる単位の中で最初に追加された順に並べ、
+# その中は追加された順に並べる。
+ORDERS = {
+    's': ('s', 'p'),
+    'p': ('p', 'o'),
+    'o': ('o', 's'),
+}
+
+
+class SQLiteStore(Store):
+    def __init__(self, predicates=None, configuration=None, identifier=None, connection=None):
+        self.predicates = frozenset(predicates) if predicates is not None else None
+        self.connection = connection
+        self.namespace_store = Memory()
+        self._intern = lru_cache(maxsize=TERM_CACHE_SIZE)(self._intern_term)
+        self._term = lru_cache(maxsize=TERM_CACHE_SIZE)(self._load_term)
+        super(SQLiteStore, self).__init__(configuration, identifier)
+
+    def open(self, configuration, create=False):
+        if not create and not os.path.exists(configuration):
+            return NO_STORE
+        # buildはスピナーを回している間に別のスレッドで読み込むので、作成したスレッド以外からも使えるようにする。
+        # 同時に使うのは1つのスレッドだけ。
+        self.connection = sqlite3.connect(configuration, check_same_thread=False)
+        self.connection.execute('PRAGMA cache_size = -{}'.format(CACHE_SIZE_KIB))
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction=False):
+        if self.connection is None:
+            return
+        if commit_pending_transaction:
+            self.connection.commit()
+        self.connection.close()
+        self.connection = None
+
+    def commit(self):
+        self.connection.commit()
+
+    # 同じデータベースを使い、prefix宣言だけを別に持つストアを返す。
+    def share(self):
+        return SQLiteStore(self.predicates, connection=self.connection)
+
+    # トリプルと記録を全て消す。
+    def clear(self):
+        for table in ('triples', 'terms', 'meta'):
+            self.connection.execute('DELETE FROM {}'.format(table))
+        self.connection.commit()
+        self._intern.cache_clear()
+        self._term.cache_clear()
+
+    # 読み込んだファイルのキーが一致する場合は、そのファイルで宣言されていたprefixを返す。
+    def source_namespaces(self, key):
+        rows = dict(self.connection.execute('SELECT name, value FROM meta'))
+        if rows.get(SOURCE_KEY) != key or SOURCE_NAMESPACES not in rows:
+            return None
+        return [(prefix, URIRef(namespace)) for prefix, namespace in json.loads(rows[SOURCE_NAMESPACES])]
+
+    def set_source(self, key, namespaces):
+        self.connection.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            (SOURCE_KEY, key),
+            (SOURCE_NAMESPACES, json.dumps([[prefix, str(namespace)] for prefix, namespace in namespaces])),
+        ])
+
+    def _find_term_id(self, encoded):
+        row = self.connection.execute(
+            'SELECT id FROM terms WHERE kind = ? AND value = ? AND datatype = ? AND language = ?', encoded).fetchone()
+        return row[0] if row else None
+
+    def _load_term(self, term_id):
+        return decode_term(*self.connection.execute(
+            'SELECT kind, value, datatype, language FROM terms WHERE id = ?', (term_id, )).fetchone())
+
+    def _intern_term(self, encoded):
+        term_id = self._find_term_id(encoded)
+        if term_id is None:
+            term_id = self.connection.execute('INSERT INTO terms (kind, value, datatype, language) VALUES (?, ?, ?, ?)',
+                                              encoded).lastrowid
+        return term_id
+
+    def add(self, triple, context, quoted=False):
+        if self.predicates is not None and triple[1] not in self.predicates:
+            return
+        term_ids = [self._intern(encode_term(term)) for term in triple]
+        self.connection.execute('INSERT OR IGNORE INTO triples VALUES (?, ?, ?)', term_ids)
+
+    def remove(self, triple_pattern, context=None):
+        where, params = self._where(triple_pattern)
+        if where is not None:
+            self.connection.execute('DELETE FROM triples' + where, params)
+
+    # パターンの絞り込みのWHERE句を作る。グラフにない項を含む場合はNoneを返す。
+    def _where(self, triple_pattern):
+        conditions = []
+        params = []
+        for column, term in zip('spo', triple_pattern):
+            if term is None:
+                continue
+            term_id = self._find_term_id(encode_term(term))
+            if term_id is None:
+                return None, None
+            conditions.append('{} = ?'.format(column))
+            params.append(term_id)
+        return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+    def triples(self, triple_pattern, context=None):
+        where, params = self._where(triple_pattern)
+        if where is None:
+            return
+        bound = [column for column, term in zip('spo', triple_pattern) if term is not None]
+        if not bound or len(bound) == 3:
+            query = 'SELECT s, p, o FROM triples{} ORDER BY rowid'.format(where)
+        else:
+            key, group = ORDERS[bound[0]]
+            query = ('SELECT s, p, o FROM (SELECT rowid AS r, s, p, o, MIN(rowid) OVER (PARTITION BY {}) AS g '
+                     'FROM triples WHERE {} = ?){} ORDER BY g, r').format(group, key, where)
+            params = [params[0]] + params
+        for row in self.connection.execute(query, params):
+            yield tuple(self._term(term_id) for term_id in row), iter(())
+
+    def __len__(self, context=None):
+        return self.connection.execute('SELECT COUNT(*) FROM triples').fetchone()[0]
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    # rdflib 6.2より前のMemory.bindはoverrideを受け取らず、NamespaceManagerからも渡されないので、
+    # 既定値以外の場合だけ渡す。
+    def bind(self, prefix, namespace, override=True):
+        if override:
+            self.namespace_store.bind(prefix, namespace)
+        else:
+            self.namespace_store.bind(prefix, namespace, override=False)
+
+    def namespace(self, prefix):
+        return self.namespace_store.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self.namespace_store.prefix(namespace)
+
+    def namespaces(self):
+        return self.namespace_store.namespaces()
@@ -0,0 +1,39 @@
+# coding:utf-8
+
+from .utils import is_ntriples
+
+
+# 文の終わりの行で区切りながら読み、(チャンク, 内容, 読んだ行数)を返す。
+# keep_dataがTrueの場合はチャンクの内容も返し、Falseの場合はNoneを返す。
+# N-Triplesは全ての行が文なので行数で区切り、prefix宣言は集めない。
+def iter_statement_chunks(stream, file_path, maximum_lines_per_file, prefixes, scheduler=None, keep_data=False):
+    ntriples = is_ntriples(file_path)
+    start = offset = 0
+    idx = count = 0
+    rows = []
+    maximum_bytes = scheduler and scheduler.chunk_bytes
+    for row in stream:
+        offset += len(row)
+        idx += 1
+        if keep_data:
+            rows.append(row)
+        row = row.strip()
+
+        if not row or row.startswith(b'#'):
+            continue
+
+        if row[0:7].lower() == b'@prefix':
+            if not ntriples:
+                prefixes.append(row.decode('utf-8') + '\n')
+            continue
+
+        if ntriples or row.endswith(b' .'):
+            count += 1
+            if count >= maximum_lines_per_file or (maximum_bytes and offset - start >= maximum_bytes):
+                yield (file_path, start, offset), b''.join(rows) if keep_data else None, idx
+                rows = []
+                start = offset
+                count = 0
+                maximum_bytes = scheduler and scheduler.chunk_bytes
+    if start < offset:
+        yield (file_path, start, offset), b''.join(rows) if keep_data else None, idx
@@ -0,0 +1,25 @@
+# coding:utf-8
+
+import os
+import pathlib
+from rdflib.plugins.parsers.notation3 import RDFSink, SinkParser
+from .compression import open_input
+from .statements import iter_statement_chunks
+
+STREAM_CHUNK_SIZE = 10000
+
+
+# turtleのファイルを文の区切りごとに少しずつパーサーに渡し、ファイル全体を文字列として持たずに読み込む。
+# パーサーは1つを使い続けるので、prefix宣言と空白ノードのラベルはファイル全体で共有される。
+# 文の区切りはbuild_indexの分割と同じく「 .」で終わる行で判断する。
+def stream_turtle(graph, file_path, chunk_size=STREAM_CHUNK_SIZE):
+    sink = RDFSink(graph)
+    base_uri = graph.absolutize(pathlib.Path(os.path.abspath(file_path)).as_uri())
+    parser = SinkParser(sink, baseURI=base_uri, turtle=True)
+    parser.startDoc()
+    with open_input(file_path) as fp:
+        for _, data, _ in iter_statement_chunks(fp, file_path, chunk_size, [], keep_data=True):
+            parser.feed(data)
+    parser.endDoc()
+    for prefix, namespace in parser._bindings.items():
+        graph.bind(prefix, namespace)
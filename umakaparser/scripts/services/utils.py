@@ -1,13 +1,19 @@
 # coding:utf-8
 
 from rdflib.plugins.parsers.ntriples import r_literal
-from rdflib import Literal, URIRef
+from rdflib import BNode, Literal, URIRef
+from rdflib.plugins.stores.memory import Memory
 from mimetypes import guess_type
 import os
+import re
+import resource
+import sys
 import i18n
 import six
 from functools import wraps
 import datetime
+from .compression import is_compressed, open_input, split_compression
+import pathlib
 
 
 IGNORE_CLASSES = set([
@@ -19,24 +25,112 @@ IGNORE_CLASSES = set([
         "http://www.w3.org/2002/07/owl#Thing",
         "http://www.w3.org/2002/07/owl#NamedIndividual"
     ]])
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+
+
+# 指定した述語のトリプルだけを保持するストア。
+# パース中に対象外のトリプルをその場で捨てるので、グラフ全体をメモリに持たない。
+class PredicateFilterStore(Memory):
+    def __init__(self, predicates, configuration=None, identifier=None):
+        super(PredicateFilterStore, self).__init__(configuration, identifier)
+        self.predicates = frozenset(predicates)
+
+    def add(self, triple, context, quoted=False):
+        if triple[1] in self.predicates:
+            super(PredicateFilterStore, self).add(triple, context, quoted)
+
+
+# 項に連番の整数IDを振る辞書。
+class TermDictionary(object):
+    def __init__(self):
+        super(TermDictionary, self).__init__()
+        self.ids = {}
+        self.terms = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def intern(self, term):
+        term_id = self.ids.get(term)
+        if term_id is None:
+            term_id = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def term(self, term_id):
+        return self.terms[term_id]
+
+
+# 項を(種類, 値, データ型, 言語)の文字列の組にする。decode_termで元の項に戻せる。
+def encode_term(term):
+    if isinstance(term, Literal):
+        return 'L', str(term), str(term.datatype or ''), term.language or ''
+    if isinstance(term, BNode):
+        return 'B', str(term), '', ''
+    return 'U', str(term), '', ''
+
+
+def decode_term(kind, value, datatype, language):
+    if kind == 'L':
+        return Literal(value, lang=language or None, datatype=URIRef(datatype) if datatype else None)
+    if kind == 'B':
+        return BNode(value)
+    if kind == 'U':
+        return URIRef(value)
+    raise ValueError('Unknown term kind: {}'.format(kind))
 
 
 def parse_literal(literal):
     return Literal(*[v if v else None for v in r_literal.match(literal).groups()])
 
 
+# 圧縮されたファイルは圧縮形式の拡張子を除いた名前で判断する。
 def get_type(file_path):
+    file_path, _ = split_compression(file_path)
     mimetype, _ = guess_type(file_path)
+    if mimetype == 'application/n-triples':
+        return 'nt'
     if mimetype:
         return mimetype.split('/')[1]
 
     _, ext = os.path.splitext(file_path)
     if ext == '.ttl':
         return 'turtle'
-    elif ext in ('.n3', '.nt'):
+    elif ext == '.nt':
+        return 'nt'
+    elif ext == '.n3':
         return 'n3'
 
 
+def is_ntriples(file_path):
+    return get_type(file_path) == 'nt'
+
+
+# ファイルをグラフに読み込む。圧縮されたファイルは展開しながらパースする。
+def parse_input(graph, file_path, format):
+    if not is_compressed(file_path):
+        graph.parse(location=file_path, format=format)
+        return
+    with open_input(file_path) as fp:
+        graph.parse(file=fp, format=format, publicID=pathlib.Path(os.path.abspath(file_path)).as_uri())
+
+
+# "512M"や"8G"のような大きさをバイト数に変換する。解釈できない場合はNoneを返す。
+def parse_size(value):
+    match = SIZE_PATTERN.match(value)
+    if match is None:
+        return None
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+# このプロセスのピーク時のRSS(バイト)。
+def peak_memory():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
 def auto_encode(msg):
     return msg.encode('utf-8') if six.PY2 else msg
 
@@ -2,9 +2,12 @@
 
 import click
 from rdflib import URIRef
-from .scripts.services.utils import get_type, i18n_t
+from .scripts.services.utils import get_type, i18n_t, parse_size
 from .scripts.services import index_owl, build_sbm_model
+from .scripts.services.assets import DEFAULT_CHUNK_SIZE
 from .scripts.services.convert import convert2ttl
+from .scripts.services.manifest import ManifestMismatchError
+from .scripts.services.model_writer import JSON_BACKENDS, has_orjson
 import i18n
 from os import getenv, path
 
@@ -26,6 +29,15 @@ def init_i18n():
 init_i18n()
 
 
+def size_option(ctx, param, value):
+    if value is None:
+        return None
+    size = parse_size(value)
+    if not size:
+        raise click.BadParameter(i18n_t('cmd.build_index.error_invalid_size', value=value))
+    return size
+
+
 @click.group()
 def cmd():
     pass
@@ -35,12 +47,28 @@ def cmd():
 @click.argument('owl_data_ttl', nargs=-1, type=click.Path(exists=True, dir_okay=False))
 @click.option('--dist', '-d',
               default='assets', type=click.Path(exists=False), help=i18n_t('cmd.build_index.opt_help_d'))
-def build_index(owl_data_ttl, dist):
+@click.option('--shards', type=click.IntRange(min=1), help=i18n_t('cmd.build_index.opt_help_shards'))
+@click.option('--format', 'asset_format', default='jsonl', type=click.Choice(['jsonl', 'binary', 'sqlite']),
+              help=i18n_t('cmd.build_index.opt_help_format'))
+@click.option('--cache', 'cache_dir', type=click.Path(file_okay=False), help=i18n_t('cmd.build_index.opt_help_cache'))
+@click.option('--scratch', 'scratch_dir', type=click.Path(file_okay=False),
+              help=i18n_t('cmd.build_index.opt_help_scratch'))
+@click.option('--resume', is_flag=True, help=i18n_t('cmd.build_index.opt_help_resume'))
+@click.option('--workers', type=click.IntRange(min=1), help=i18n_t('cmd.build_index.opt_help_workers'))
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, type=click.IntRange(min=1),
+              help=i18n_t('cmd.build_index.opt_help_chunk_size'))
+@click.option('--max-memory', callback=size_option, help=i18n_t('cmd.build_index.opt_help_max_memory'))
+@click.option('--for-sbm', 'sbm_file', type=click.Path(exists=True, dir_okay=False),
+              help=i18n_t('cmd.build_index.opt_help_for_sbm'))
+def build_index(owl_data_ttl, dist, shards=None, asset_format='jsonl', cache_dir=None, scratch_dir=None, resume=False,
+                workers=None, chunk_size=DEFAULT_CHUNK_SIZE, max_memory=None, sbm_file=None):
     if not owl_data_ttl:
         raise click.UsageError(i18n_t('cmd.build_index.error_not_specified'))
+    if resume and not scratch_dir:
+        raise click.UsageError(i18n_t('cmd.build_index.error_resume_requires_scratch'))
 
     for owl_data in owl_data_ttl:
-        if get_type(owl_data) not in ('turtle', 'n3'):
+        if get_type(owl_data) not in ('turtle', 'n3', 'nt'):
             raise click.UsageError(i18n_t('cmd.build_index.error_invalid_type'))
 
     target_properties = {
@@ -50,7 +78,12 @@ def build_index(owl_data_ttl, dist):
         URIRef('http://www.w3.org/2000/01/rdf-schema#domain'): 'domain',
         URIRef('http://www.w3.org/2000/01/rdf-schema#range'): 'range',
     }
-    output = index_owl(owl_data_ttl, target_properties, dist)
+    try:
+        output = index_owl(
+            owl_data_ttl, target_properties, dist, shards, asset_format, cache_dir, scratch_dir, resume,
+            workers, chunk_size, max_memory, sbm_file)
+    except ManifestMismatchError as e:
+        raise click.UsageError(i18n_t('cmd.build_index.error_resume_mismatch', path=str(e)))
     click.echo('>>> {}'.format(output))
 
 
@@ -64,8 +97,21 @@ def convert(owl_data_files):
 @click.argument('sbm_data_ttl', nargs=1, type=click.Path(exists=True))
 @click.option('--assets', '-a', type=click.Path(exists=True), help=i18n_t('cmd.build.opt_help_a'))
 @click.option('--dist', '-d', default='model.json', type=click.Path(exists=False, dir_okay=False), help=i18n_t('cmd.build.opt_help_d'))
-def build(sbm_data_ttl, assets=None, dist=None):
-    dist_file = build_sbm_model(sbm_data_ttl, assets, dist)
+@click.option('--stream', is_flag=True, help=i18n_t('cmd.build.opt_help_stream'))
+@click.option('--snapshot', is_flag=True, help=i18n_t('cmd.build.opt_help_snapshot'))
+@click.option('--store', type=click.Path(dir_okay=False), help=i18n_t('cmd.build.opt_help_store'))
+@click.option('--structure', type=click.Choice(['tree', 'dag']), default='tree',
+              help=i18n_t('cmd.build.opt_help_structure'))
+@click.option('--compact', is_flag=True, help=i18n_t('cmd.build.opt_help_compact'))
+@click.option('--gzip', 'compress', is_flag=True, help=i18n_t('cmd.build.opt_help_gzip'))
+@click.option('--json-backend', type=click.Choice(JSON_BACKENDS), default='json',
+              help=i18n_t('cmd.build.opt_help_json_backend'))
+def build(sbm_data_ttl, assets=None, dist=None, stream=False, snapshot=False, store=None, structure='tree',
+          compact=False, compress=False, json_backend='json'):
+    if json_backend == 'orjson' and not has_orjson():
+        raise click.UsageError(i18n_t('cmd.build.error_orjson_missing'))
+    dist_file = build_sbm_model(
+        sbm_data_ttl, assets, dist, stream, snapshot, store, structure, compact, compress, json_backend)
     if dist_file:
         click.echo('>>> {}'.format(dist_file))
 